@@ -0,0 +1,243 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pyarrow as pa
+
+from cohorts import COHORT_DAYS, load_cohorts
+from cube import load_cube
+from guns import load_guns
+from loader import DATA_DIR, load
+from memo import dataset_versions, filter_state, memoized
+from quantiles import load_quantiles
+from sections import (DURATION_VALUES, TOP_OPTIONS, churn_frame, clean_selection, duration_seconds, duration_totals,
+                      gun_table, loserate_frame)
+
+# 0 leaves the API off when app.py starts; ``python api.py`` serves it alone
+API_PORT = int(os.environ.get('DASHBOARD_API_PORT', 0))
+# Rows per Arrow record batch or JSON chunk written to the socket
+BATCH_ROWS = 50_000
+ARROW_TYPE = 'application/vnd.apache.arrow.stream'
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _countries(params):
+    countries = [c for c in params.get('countries', 'all').split(',') if c]
+    return clean_selection(countries or ['all'])
+
+
+def _levels(params, top):
+    try:
+        low = int(params.get('level_min', 1))
+        high = int(params.get('level_max', top))
+    except ValueError:
+        raise BadRequest('level_min and level_max must be integers') from None
+    return low, high
+
+
+def _top(params):
+    top = params.get('top', 'Top-1')
+    top = top if top in TOP_OPTIONS else f'Top-{top}'
+    if top not in TOP_OPTIONS:
+        raise BadRequest(f"top must be one of {', '.join(TOP_OPTIONS)}")
+    return top
+
+
+def _retention(data_dir, params):
+    countries = _countries(params)
+    day = params.get('day')
+    if day is not None and not day.isdigit():
+        raise BadRequest('day must be a whole number of days')
+    day = None if day is None else int(day)
+    if day is not None and not 1 <= day <= COHORT_DAYS:
+        raise BadRequest(f'day must be between 1 and {COHORT_DAYS}')
+    if day is not None and day not in (1, 7):
+        # Days other than the exported ones come from the install cohorts
+        cohorts = load_cohorts(data_dir)
+        if cohorts is None:
+            raise BadRequest('only days 1 and 7 are exported')
+
+        def compute():
+            return cohorts.day_n(day)
+        dataset = 'cohorts'
+    else:
+        df_r = load('retention', data_dir)
+
+        def compute():
+            return df_r if day is None else df_r.loc[df_r['retention_days'] == day]
+        dataset = 'retention'
+
+    def select():
+        df = compute()
+        if 'all' not in countries:
+            df = df.loc[df['country'].isin(countries)]
+        return df.reset_index(drop=True)
+    return dataset, select, dict(countries=countries, day=day)
+
+
+def _level_section(name, values, frame):
+    def section(data_dir, params):
+        cube = load_cube(name, values, data_dir=data_dir)
+        countries, levels = _countries(params), _levels(params, cube.max_level)
+
+        def compute():
+            # Every level; binning is for charts only
+            df = frame(cube, countries, *levels, max_points=float('inf'))
+            return df.drop(columns='last_level').reset_index()
+        return name, compute, dict(countries=countries, levels=levels)
+    return section
+
+
+def _duration_section(name, hist, level_col):
+    def section(data_dir, params):
+        cube = load_cube(name, DURATION_VALUES, level_col=level_col, prepare=duration_totals, data_dir=data_dir)
+        quantiles = load_quantiles(hist, level_col=level_col, data_dir=data_dir)
+        countries, levels = _countries(params), _levels(params, cube.max_level)
+
+        def compute():
+            df = duration_seconds(cube, countries, *levels, quantiles)
+            return df.reset_index(drop=df.index.names == [None])
+        return (name, hist), compute, dict(countries=countries, levels=levels)
+    return section
+
+
+def _guns(data_dir, params):
+    guns = load_guns(data_dir)
+    countries, levels, top = _countries(params), _levels(params, guns.max_level), _top(params)
+
+    def compute():
+        return gun_table(guns, countries, *levels, top)
+    return 'popul_guns', compute, dict(countries=countries, levels=levels, top=top)
+
+
+# path: function of (data_dir, query parameters) returning the datasets read,
+# a function computing the table and the widget-equivalent filters
+ENDPOINTS = {
+    'retention': _retention,
+    'loserate': _level_section('loserate', ['players_started', 'players_completed'], loserate_frame),
+    'churn': _level_section('lose_users', ['players_started', 'players_churned'], churn_frame),
+    'level_duration': _duration_section('avg_dur_lev', 'dur_hist_lev', 'level'),
+    'session_duration': _duration_section('avg_dur_sess', 'dur_hist_sess', 'session_rank'),
+    'guns': _guns,
+}
+
+
+def _current_dir():
+    # The snapshot the dashboard is serving, read once per request
+    from refresh import get_refresher
+    snapshot = get_refresher().current()
+    return DATA_DIR if snapshot is None else snapshot.path
+
+
+def etag(endpoint, datasets, filters, fmt, data_dir):
+    """Changes with the snapshot or export version of any dataset read."""
+    raw = json.dumps([endpoint, data_dir, dataset_versions(datasets, data_dir), filter_state(**filters), fmt],
+                     default=str)
+    return '"' + hashlib.sha1(raw.encode()).hexdigest() + '"'
+
+
+def _json_chunks(df):
+    yield b'['
+    for start in range(0, len(df), BATCH_ROWS):
+        body = df.iloc[start:start + BATCH_ROWS].to_json(orient='records', date_format='iso')[1:-1]
+        yield (b',' if start else b'') + body.encode()
+    yield b']'
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'DashboardAPI/1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        endpoint = url.path.strip('/')
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if endpoint == '':
+            return self._send_json(200, {'endpoints': sorted(ENDPOINTS), 'parameters': [
+                'countries=US,IN or all', 'level_min', 'level_max', 'top=Top-1|Top-3|Top-5|Top-10', 'day',
+                'format=json|arrow']})
+        if endpoint not in ENDPOINTS:
+            return self._send_json(404, {'error': f'unknown endpoint {endpoint!r}'})
+        fmt = params.pop('format', 'arrow' if ARROW_TYPE in self.headers.get('Accept', '') else 'json')
+        if fmt not in ('json', 'arrow'):
+            return self._send_json(400, {'error': 'format must be json or arrow'})
+
+        data_dir = _current_dir()
+        try:
+            datasets, compute, filters = ENDPOINTS[endpoint](data_dir, params)
+        except BadRequest as e:
+            return self._send_json(400, {'error': str(e)})
+        except FileNotFoundError:
+            return self._send_json(404, {'error': f'no data exported for {endpoint!r}'})
+
+        tag = etag(endpoint, datasets, filters, fmt, data_dir)
+        if tag in [t.strip() for t in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', tag)
+            self.end_headers()
+            return
+
+        df = memoized('api_' + endpoint, datasets, compute, data_dir=data_dir, **filters)
+        self.send_response(200)
+        self.send_header('ETag', tag)
+        self.send_header('Cache-Control', 'no-cache')
+        # No Content-Length: the body is written batch by batch and the
+        # connection closed at the end
+        self.send_header('Connection', 'close')
+        self.send_header('Content-Type', ARROW_TYPE if fmt == 'arrow' else 'application/json')
+        self.end_headers()
+        try:
+            if fmt == 'arrow':
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                with pa.ipc.new_stream(self.wfile, table.schema) as writer:
+                    for batch in table.to_batches(max_chunksize=BATCH_ROWS):
+                        writer.write_batch(batch)
+            else:
+                for chunk in _json_chunks(df):
+                    self.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading; nothing left to send it
+            pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve(port=API_PORT, host='127.0.0.1'):
+    # One server per process, next to the dashboard or on its own
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), Handler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name='dashboard-api', daemon=True).start()
+        return _server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve the dashboard aggregates as JSON and Arrow over HTTP')
+    parser.add_argument('--port', type=int, default=API_PORT or 8502)
+    parser.add_argument('--host', default='127.0.0.1')
+    args = parser.parse_args()
+
+    server = serve(args.port, args.host)
+    print(f'http://{args.host}:{server.server_address[1]}/')
+    threading.Event().wait()
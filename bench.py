@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import synthetic
+from cube import LevelCube
+from engine import write
+from guns import GunPopularity
+from instrument import figure_bytes, table_bytes
+from loader import SNAPSHOT_EXT, read_export, resolve_path
+from quantiles import DurationQuantiles
+from sections import (COUNTRIES, DEFAULT_COUNTRIES, DURATION_VALUES, churn_fig, churn_frame, duration_seconds,
+                      duration_totals, gun_table, loserate_fig, loserate_frame, retention_by_country,
+                      retention_gauges, retention_totals)
+from tables import PagedTable
+
+HISTORY_FILE = 'benchmarks.jsonl'
+
+# Typical widget states: the defaults, the five big markets, and the full
+# range with a paged table sorted by its last column, descending
+STATES = {
+    'default': {'countries': ['all'], 'retention_countries': DEFAULT_COUNTRIES,
+                'level_min': 1, 'level_max': 10, 'top': 'Top-1', 'sort': False},
+    'markets': {'countries': DEFAULT_COUNTRIES, 'retention_countries': DEFAULT_COUNTRIES,
+                'level_min': 1, 'level_max': 10, 'top': 'Top-5', 'sort': False},
+    'full_range': {'countries': ['all'], 'retention_countries': COUNTRIES,
+                   'level_min': 1, 'level_max': None, 'top': 'Top-10', 'sort': True},
+}
+
+
+def _retention(frames, state, _):
+    df_r = frames['retention']
+    df_r_all = retention_totals(df_r)
+    return lambda: [retention_gauges(df_r_all), *retention_by_country(df_r, state['retention_countries'])]
+
+
+def _level_section(frame_fn, fig_fn):
+    def section(frames, state, cube):
+        level_max = state['level_max'] or cube.max_level
+        df = frame_fn(cube, state['countries'], state['level_min'], level_max)
+        return lambda: [fig_fn(df)]
+    return section
+
+
+def _page(table, state):
+    # What a rerun of a paged section does: format one page, as app.paged_table
+    if state['sort']:
+        return lambda: [table.page(1, table.columns[-1], ascending=False)]
+    return lambda: [table.page(1)]
+
+
+def _duration(frames, state, built):
+    cube, quantiles = built
+    level_max = state['level_max'] or cube.max_level
+    table = PagedTable(duration_seconds(cube, state['countries'], state['level_min'], level_max, quantiles))
+    return _page(table, state)
+
+
+def _guns(frames, state, guns):
+    level_max = state['level_max'] or guns.max_level
+    table = PagedTable(gun_table(guns, state['countries'], state['level_min'], level_max, state['top']))
+    return _page(table, state)
+
+
+def _durations(level_col):
+    def build(df, hist):
+        return (LevelCube(duration_totals(df), DURATION_VALUES, level_col=level_col),
+                DurationQuantiles(hist, level_col=level_col))
+    return build
+
+
+# name: (datasets, build step run once per dataset version, aggregate step per
+# widget state); the build step gets one frame per dataset
+SECTIONS = {
+    'retention': ('retention', lambda df: None, _retention),
+    'loserate': ('loserate', lambda df: LevelCube(df, ['players_started', 'players_completed']),
+                 _level_section(loserate_frame, loserate_fig)),
+    'churn': ('lose_users', lambda df: LevelCube(df, ['players_started', 'players_churned']),
+              _level_section(churn_frame, churn_fig)),
+    'level_duration': (('avg_dur_lev', 'dur_hist_lev'), _durations('level'), _duration),
+    'session_duration': (('avg_dur_sess', 'dur_hist_sess'), _durations('session_rank'), _duration),
+    'guns': ('popul_guns', GunPopularity, _guns),
+}
+
+
+def _timed(fn, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, float(np.median(times))
+
+
+def run(data_dir, repeat=5, fmt='csv', sections=None):
+    records = []
+    for name, (datasets, build, aggregate) in SECTIONS.items():
+        if sections and name not in sections:
+            continue
+        datasets = (datasets,) if isinstance(datasets, str) else datasets
+        if fmt == 'arrow':
+            paths = [os.path.join(data_dir, dataset + SNAPSHOT_EXT) for dataset in datasets]
+        else:
+            paths = [resolve_path(dataset, data_dir) for dataset in datasets]
+        dfs, load_s = _timed(lambda: [read_export(path) for path in paths], repeat)
+        built, build_s = _timed(lambda: build(*dfs), repeat)
+        df = dfs[0]
+        for state_name, state in STATES.items():
+            render, aggregate_s = _timed(lambda: aggregate(dict(zip(datasets, dfs)), state, built), repeat)
+            outputs, render_s = _timed(render, repeat)
+            payload = sum(table_bytes(o) if hasattr(o, 'columns') else figure_bytes(o) for o in outputs)
+            records.append({
+                'section': name, 'state': state_name, 'rows': len(df),
+                'load_s': load_s, 'build_s': build_s, 'aggregate_s': aggregate_s, 'render_s': render_s,
+                'payload_bytes': payload,
+            })
+    return records
+
+
+def _revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _previous(history, scale, fmt):
+    last = {}
+    if not os.path.exists(history):
+        return last
+    with open(history) as f:
+        for line in f:
+            rec = json.loads(line)
+            if rec.get('scale') == scale and rec.get('format') == fmt:
+                last[(rec['section'], rec['state'])] = rec
+    return last
+
+
+def report(records, previous):
+    print(f"{'section':<17}{'state':<11}{'rows':>9}{'load ms':>9}{'build ms':>10}{'agg ms':>9}"
+          f"{'render ms':>11}{'payload KB':>12}{'vs last':>9}")
+    for r in records:
+        total = r['load_s'] + r['build_s'] + r['aggregate_s'] + r['render_s']
+        prev = previous.get((r['section'], r['state']))
+        delta = ''
+        if prev:
+            prev_total = prev['load_s'] + prev['build_s'] + prev['aggregate_s'] + prev['render_s']
+            delta = f'{(total / prev_total - 1) * 100:+.0f}%'
+        print(f"{r['section']:<17}{r['state']:<11}{r['rows']:>9}{r['load_s'] * 1000:>9.1f}"
+              f"{r['build_s'] * 1000:>10.1f}{r['aggregate_s'] * 1000:>9.1f}{r['render_s'] * 1000:>11.1f}"
+              f"{r['payload_bytes'] / 1024:>12.1f}{delta:>9}")
+
+
+def main(scales, repeat, fmt, history, seed):
+    for scale in scales:
+        with tempfile.TemporaryDirectory(prefix=f'bench_{scale}x_') as data_dir:
+            write(synthetic.generate(scale, seed), data_dir, stamp='000000000000')
+            if fmt == 'arrow':
+                from snapshot import convert_all
+                convert_all(data_dir)
+            records = run(data_dir, repeat, fmt)
+
+        print(f'\n== scale {scale}x ({fmt})')
+        report(records, _previous(history, scale, fmt))
+        stamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+        revision = _revision()
+        with open(history, 'a') as f:
+            for r in records:
+                f.write(json.dumps({'time': stamp, 'revision': revision, 'scale': scale, 'format': fmt,
+                                    'seed': seed, **r}) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the dashboard sections on synthetic data')
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--format', choices=['csv', 'arrow'], default='csv')
+    parser.add_argument('--history', default=HISTORY_FILE)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    main(args.scale, args.repeat, args.format, args.history, args.seed)
@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+
+from loader import DATA_DIR, BuiltCache, load
+
+# Days after the first session that are tracked per install cohort
+COHORT_DAYS = 30
+
+EPOCH = pd.Timestamp(0)
+
+
+def to_days(dates):
+    return ((pd.to_datetime(dates) - EPOCH) // pd.Timedelta(days=1)).astype('int64')
+
+
+def _day_numbers(dates):
+    if isinstance(dates.dtype, pd.CategoricalDtype):
+        # Snapshots store the dates as categories; parse each distinct one once
+        return np.asarray(to_days(dates.cat.categories))[dates.cat.codes.to_numpy()]
+    return np.asarray(to_days(dates))
+
+
+def to_dates(days):
+    return (EPOCH + pd.to_timedelta(np.asarray(days, dtype=np.int64), unit='D')).strftime('%Y-%m-%d')
+
+
+def cohort_counts(country, first_day, day):
+    """Devices per (country, install day, days since install).
+
+    Takes one entry per distinct (device, active day) along with the device's
+    country and first day, and accumulates every cell with one bincount over
+    a flattened index instead of joining activity back onto first sessions.
+    """
+    first_day = np.asarray(first_day, dtype=np.int64)
+    offset = np.asarray(day, dtype=np.int64) - first_day
+    keep = (offset >= 0) & (offset <= COHORT_DAYS)
+    if not keep.any():
+        return pd.DataFrame({'country': pd.Series(dtype=object), 'cohort_day': pd.Series(dtype='int64'),
+                             'day': pd.Series(dtype='int64'), 'users': pd.Series(dtype='int64')})
+    codes, countries = pd.factorize(np.asarray(country, dtype=object)[keep])
+    first_day, offset = first_day[keep], offset[keep]
+    base = first_day.min()
+    span = int(first_day.max() - base) + 1
+    width = COHORT_DAYS + 1
+
+    flat = (codes * span + (first_day - base)) * width + offset
+    counts = np.bincount(flat, minlength=len(countries) * span * width)
+    cell = np.flatnonzero(counts)
+    c, rest = np.divmod(cell, span * width)
+    k, d = np.divmod(rest, width)
+    return pd.DataFrame({'country': np.asarray(countries, dtype=object)[c], 'cohort_day': base + k,
+                         'day': d, 'users': counts[cell]})
+
+
+class CohortMatrix:
+    """Dense country x install cohort x day users array for any day-N retention.
+
+    A cohort's retention on day N only counts once the data reaches N days
+    past its install date, so recent cohorts don't drag the rates down.
+    """
+
+    def __init__(self, df):
+        countries = np.asarray(df['country'].astype(object).fillna(''), dtype=str)
+        cohort = _day_numbers(df['cohort_date'])
+        day = df['day'].to_numpy(np.int64)
+        self.countries = np.unique(countries)
+        self._country_pos = {c: i for i, c in enumerate(self.countries)}
+        self.first_day = int(cohort.min()) if len(cohort) else 0
+        span = int(cohort.max()) - self.first_day + 1 if len(cohort) else 0
+        self.dates = pd.DatetimeIndex(to_dates(self.first_day + np.arange(span)), name='cohort')
+
+        width = COHORT_DAYS + 1
+        ci = np.searchsorted(self.countries, countries)
+        flat = (ci * span + cohort - self.first_day) * width + day
+        shape = (len(self.countries), span, width)
+        self.users = np.bincount(flat, weights=df['users'].to_numpy(np.float64),
+                                 minlength=int(np.prod(shape))).astype(np.int64).reshape(shape)
+        self.total = self.users.sum(axis=0)
+        # Last day with any activity, counted from the first cohort
+        k, d = np.nonzero(self.total)
+        self.last = int((k + d).max()) if len(k) else -1
+        for array in (self.users, self.total):
+            array.setflags(write=False)
+
+    @property
+    def nbytes(self):
+        return self.users.nbytes + self.total.nbytes
+
+    def _cells(self, countries):
+        if countries is None or 'all' in countries:
+            return self.total
+        rows = [self._country_pos[c] for c in countries if c in self._country_pos]
+        return self.users[rows].sum(axis=0)
+
+    def day_n(self, n):
+        """Day-N retention per country, in the columns of the retention export."""
+        mature = self.users[:, :max(0, self.last - n + 1)]
+        installed = mature[:, :, 0].sum(axis=1)
+        retained = mature[:, :, n].sum(axis=1)
+        keep = installed > 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percent = np.round(retained * 100.0 / installed, 2)
+        return pd.DataFrame({'country': self.countries[keep], 'retention_days': n,
+                             'total_users': installed[keep], 'retention_count': retained[keep],
+                             'retention_percent': percent[keep]})
+
+    def matrix(self, countries):
+        """Percent of each cohort active N days after install; NaN past the data."""
+        cells = self._cells(countries)
+        installed = cells[:, 0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percent = cells * 100.0 / installed[:, None]
+        ages = np.arange(len(cells))[:, None] + np.arange(COHORT_DAYS + 1)
+        percent[ages > self.last] = np.nan
+        keep = installed > 0
+        return pd.DataFrame(percent[keep], index=self.dates[keep],
+                            columns=pd.RangeIndex(COHORT_DAYS + 1, name='day'))
+
+
+_built = BuiltCache()
+
+
+def load_cohorts(data_dir=DATA_DIR, days=None):
+    # None when no cohort export exists yet for this data directory; days
+    # selects install dates
+    try:
+        df = load('cohorts', data_dir, days)
+    except FileNotFoundError:
+        return None
+    return _built.get((data_dir, 'cohorts', days is not None), df, CohortMatrix)
+
+
+def memory_usage():
+    return _built.memory_usage()
+
+
+def forget(data_dir):
+    _built.forget(data_dir)
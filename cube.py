@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+
+from loader import DATA_DIR, BuiltCache, load
+
+
+class LevelCube:
+    """Dense country x level x value array with totals over all countries.
+
+    Built once per dataset version; a country selection plus a level range is
+    then answered from the array without filtering or grouping the frame.
+    Levels are stored by rank, so sparse level ids don't blow up the array.
+    The arrays are shared by every session and are made read-only.
+    """
+
+    def __init__(self, df, values, level_col='level'):
+        self.values = list(values)
+        self.level_col = level_col
+        countries = np.asarray(df['country'].astype(object).fillna(''), dtype=str)
+        self.countries = np.unique(countries)
+        self.levels = np.sort(df[level_col].unique()).astype(np.int64)
+        self._country_pos = {c: i for i, c in enumerate(self.countries)}
+
+        ci = np.searchsorted(self.countries, countries)
+        li = np.searchsorted(self.levels, df[level_col].to_numpy())
+        dtype = np.int64 if all(pd.api.types.is_integer_dtype(df[v]) for v in self.values) else np.float64
+
+        shape = (len(self.countries), len(self.levels))
+        self.data = np.zeros(shape + (len(self.values),), dtype=dtype)
+        for k, col in enumerate(self.values):
+            np.add.at(self.data[:, :, k], (ci, li), df[col].to_numpy(dtype))
+        self.present = np.zeros(shape, dtype=bool)
+        self.present[ci, li] = True
+
+        # "all" is kept as a pre-summed row so that it costs the same as a
+        # single country
+        self.total = self.data.sum(axis=0)
+        self.total_present = self.present.sum(axis=0)
+        for array in (self.data, self.present, self.total, self.total_present):
+            array.setflags(write=False)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.data, self.present, self.total, self.total_present))
+
+    @property
+    def min_level(self):
+        return int(self.levels[0]) if len(self.levels) else 1
+
+    @property
+    def max_level(self):
+        return int(self.levels[-1]) if len(self.levels) else 1
+
+    def _rows(self, countries):
+        if countries is None or 'all' in countries:
+            return None
+        return [self._country_pos[c] for c in countries if c in self._country_pos]
+
+    def _span(self, level_min, level_max):
+        lo = np.searchsorted(self.levels, level_min, side='left')
+        hi = np.searchsorted(self.levels, level_max, side='right')
+        return lo, max(lo, hi)
+
+    def by_level(self, countries, level_min, level_max):
+        lo, hi = self._span(level_min, level_max)
+        rows = self._rows(countries)
+        if rows is None:
+            block, present = self.total[lo:hi], self.total_present[lo:hi]
+        else:
+            block = self.data[rows, lo:hi].sum(axis=0)
+            present = self.present[rows, lo:hi].sum(axis=0)
+        keep = present > 0
+        index = pd.Index(self.levels[lo:hi][keep], name=self.level_col)
+        return pd.DataFrame(block[keep], index=index, columns=self.values)
+
+    def count_levels(self, level_min, level_max):
+        lo, hi = self._span(level_min, level_max)
+        return int(hi - lo)
+
+    def binned(self, countries, level_min, level_max, max_bins):
+        """by_level() summed over runs of consecutive levels, at most max_bins rows.
+
+        Runs are cut by rank, so a sparse id such as an outlier level ends up
+        in a run of its neighbours by rank rather than stretching the axis.
+        Rows are indexed by the first level of the run, with its last level in
+        ``last_level``.
+        """
+        df = self.by_level(countries, level_min, level_max)
+        levels = df.index.to_numpy()
+        if len(df) <= max_bins:
+            return df.assign(last_level=levels)
+        starts = np.linspace(0, len(df), max_bins, endpoint=False).astype(np.intp)
+        ends = np.append(starts[1:], len(df)) - 1
+        sums = np.add.reduceat(df.to_numpy(), starts, axis=0)
+        out = pd.DataFrame(sums, index=pd.Index(levels[starts], name=self.level_col), columns=self.values)
+        out['last_level'] = levels[ends]
+        return out
+
+    def by_country_level(self, countries, level_min, level_max):
+        lo, hi = self._span(level_min, level_max)
+        rows = self._rows(countries)
+        if rows is None:
+            rows = list(range(len(self.countries)))
+        rows = np.array(sorted(set(rows)), dtype=np.intp)
+        ci, li = np.nonzero(self.present[rows, lo:hi])
+        # Gather just the present cells instead of slicing out the whole block
+        ci, li = rows[ci], li + lo
+        index = pd.MultiIndex.from_arrays(
+            [self.countries[ci], self.levels[li]], names=['country', self.level_col])
+        block = self.data[ci, li]
+        return pd.DataFrame(block, index=index, columns=self.values)
+
+
+_built = BuiltCache()
+
+
+def load_cube(name, values, level_col='level', prepare=None, data_dir=DATA_DIR, days=None):
+    # Rebuilt only when the loader hands back a new frame, i.e. when the
+    # underlying export changed; prepare adapts the frame before building.
+    # One date-range cube is kept next to the full one
+    df = load(name, data_dir, days)
+    key = (data_dir, name, tuple(values), level_col, prepare, days is not None)
+    return _built.get(key, df,
+                      lambda df: LevelCube(df if prepare is None else prepare(df), values, level_col=level_col))
+
+
+def memory_usage():
+    return _built.memory_usage()
+
+
+def forget(data_dir):
+    _built.forget(data_dir)
@@ -0,0 +1,352 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from cohorts import EPOCH, cohort_counts, to_dates, to_days
+from loader import DATA_DIR, read_csv
+from quantiles import bucket_of, histogram
+from sketch import SKETCH_FILE, SketchBuilder, hash_ids
+
+# Columns of the raw test.events / test.devices exports used by code_1..code_6
+EVENT_COLUMNS = ['device_id', 'session', 'server_date', 'server_time', 'event', 'level', 'param1', 'extra']
+DEVICE_COLUMNS = ['device_id', 'country']
+
+RETENTION_DAYS = (1, 7)
+COMPACT_ROWS = 1_000_000
+
+_GUN_RE = r'"gun_name"\s*:\s*"([^"]*)"'
+_LEVEL_TNT_RE = r'"level_tnt"\s*:\s*(-?\d+)'
+
+
+class DistinctRows:
+    """Set of distinct rows accumulated chunk by chunk.
+
+    Chunks are deduplicated on arrival and merged into the running set once
+    the pending rows exceed COMPACT_ROWS, so memory follows the number of
+    distinct keys rather than the number of events.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._frames = []
+        self._pending = 0
+
+    def add(self, df):
+        df = df[self.columns].drop_duplicates()
+        self._frames.append(df)
+        self._pending += len(df)
+        if self._pending > COMPACT_ROWS:
+            self._compact()
+
+    def _compact(self):
+        if len(self._frames) > 1:
+            self._frames = [pd.concat(self._frames, ignore_index=True).drop_duplicates()]
+        self._pending = 0
+
+    def frame(self):
+        self._compact()
+        if not self._frames:
+            return pd.DataFrame({c: pd.Series(dtype='int64') for c in self.columns})
+        return self._frames[0]
+
+
+class GroupedAgg:
+    """Running groupby aggregate that is re-reduced as chunks arrive."""
+
+    def __init__(self, keys, aggs):
+        self.keys = keys
+        self.aggs = aggs
+        self._frames = []
+        self._pending = 0
+
+    def add(self, df):
+        part = df.groupby(self.keys, sort=False).agg(**self._named(df.columns))
+        self._frames.append(part)
+        self._pending += len(part)
+        if self._pending > COMPACT_ROWS:
+            self._compact()
+
+    def _named(self, columns):
+        return {out: (col, fn) for out, (col, fn) in self.aggs.items() if col in columns}
+
+    def _compact(self):
+        if len(self._frames) > 1:
+            merged = pd.concat(self._frames)
+            self._frames = [merged.groupby(level=self.keys, sort=False).agg(
+                {out: fn if fn != 'count' else 'sum' for out, (_, fn) in self.aggs.items()})]
+        self._pending = 0
+
+    def frame(self):
+        self._compact()
+        if not self._frames:
+            index = pd.MultiIndex.from_arrays([[]] * len(self.keys), names=self.keys)
+            return pd.DataFrame(columns=list(self.aggs), index=index)
+        return self._frames[0]
+
+
+def _to_seconds(col):
+    if pd.api.types.is_numeric_dtype(col):
+        return col.astype('int64')
+    return ((pd.to_datetime(col) - EPOCH) // pd.Timedelta(seconds=1)).astype('int64')
+
+
+class MetricsEngine:
+    """Computes the dashboard datasets in one pass over chunked events.
+
+    Feed chunks of the raw events export with ``feed`` and collect the tables
+    with ``results``; the output columns match the CSV exports in data/.
+    """
+
+    def __init__(self, devices, sketches=False):
+        devices = devices.drop_duplicates('device_id')
+        self.device_index = pd.Index(devices['device_id'])
+        self.device_country = devices['country'].astype(object).fillna('').to_numpy()
+        self.first_day = np.full(len(self.device_index), np.iinfo(np.int64).max, dtype=np.int64)
+
+        self.active_days = DistinctRows(['device', 'day'])
+        self.started = DistinctRows(['device', 'level'])
+        self.completed = DistinctRows(['device', 'level'])
+        self.gun_picks = DistinctRows(['device', 'level', 'gun_name'])
+        self.level_duration = GroupedAgg(['device', 'level'], {
+            'sum': ('param1', 'sum'), 'count': ('param1', 'count')})
+        self.level_buckets = GroupedAgg(['country', 'level', 'bucket'], {'count': ('bucket', 'count')})
+        self.sessions = GroupedAgg(['device', 'session'], {
+            'start': ('server_time', 'min'), 'end': ('server_time', 'max')})
+        # Optional per (metric, country, level, day) distinct-device sketches
+        self.sketches = SketchBuilder() if sketches else None
+        self.rows = 0
+
+    def feed(self, chunk):
+        # Inner join with test.devices: events from unknown devices are dropped
+        device = self.device_index.get_indexer(chunk['device_id'])
+        known = device >= 0
+        chunk = chunk.loc[known]
+        device = device[known]
+        self.rows += len(chunk)
+        if not len(chunk):
+            return
+
+        day = to_days(chunk['server_date']).to_numpy()
+        np.minimum.at(self.first_day, device, day)
+        self.active_days.add(pd.DataFrame({'device': device, 'day': day}))
+
+        event = chunk['event'].to_numpy()
+        level = pd.to_numeric(chunk['level'], errors='coerce').fillna(0).astype('int64').to_numpy()
+        started = event == 'level_started'
+        completed = event == 'level_completed'
+        self.started.add(pd.DataFrame({'device': device[started], 'level': level[started]}))
+        self.completed.add(pd.DataFrame({'device': device[completed], 'level': level[completed]}))
+
+        param1 = pd.to_numeric(chunk['param1'], errors='coerce').to_numpy()[completed]
+        self.level_duration.add(pd.DataFrame({
+            'device': device[completed], 'level': level[completed], 'param1': param1}))
+        timed = ~np.isnan(param1)
+        self.level_buckets.add(pd.DataFrame({
+            'country': self.device_country[device[completed][timed]], 'level': level[completed][timed],
+            'bucket': bucket_of(param1[timed])}))
+
+        self.sessions.add(pd.DataFrame({
+            'device': device, 'session': chunk['session'].to_numpy(),
+            'server_time': _to_seconds(chunk['server_time']).to_numpy()}))
+
+        extra = chunk['extra'].astype(object).fillna('').astype(str)[started]
+        gun = extra.str.extract(_GUN_RE, expand=False).fillna('')
+        level_tnt = pd.to_numeric(extra.str.extract(_LEVEL_TNT_RE, expand=False), errors='coerce').fillna(0)
+        self.gun_picks.add(pd.DataFrame({
+            'device': device[started], 'level': level_tnt.astype('int64').to_numpy(),
+            'gun_name': gun.to_numpy()}))
+
+        if self.sketches is not None:
+            self._sketch(chunk, device, day, event, level, started)
+
+    def _sketch(self, chunk, device, day, event, level, started):
+        # Hashing the raw device_id keeps sketches from different exports
+        # mergeable. Only the level events are sketched: they are what the
+        # dashboard unions across levels and days
+        tracked = started | (event == 'level_completed')
+        hashes = hash_ids(chunk['device_id'].to_numpy()[tracked])
+        self.sketches.add(pd.DataFrame({
+            'metric': event[tracked], 'country': self.device_country[device][tracked], 'level': level[tracked],
+            'day': day[tracked]}), hashes)
+
+    def _country(self, device):
+        return self.device_country[np.asarray(device, dtype=np.int64)]
+
+    def partials(self):
+        """Additive per-cell counts and sums.
+
+        Every distinct count here is over devices, so partials from engines
+        fed with disjoint device sets can be added up with ``combine``.
+        """
+        seen = self.first_day != np.iinfo(np.int64).max
+        total_users = pd.Series(self.device_country[seen]).value_counts().rename_axis('country')
+
+        active = self.active_days.frame()
+        device = active['device'].to_numpy()
+        days = active['day'].to_numpy() - self.first_day[device]
+        keep = np.isin(days, RETENTION_DAYS)
+        hits = pd.DataFrame({'country': self._country(device[keep]), 'retention_days': days[keep]})
+        cohorts = cohort_counts(self._country(device), self.first_day[device], active['day'])
+
+        durations = self.level_duration.frame().reset_index()
+        durations['country'] = self._country(durations['device'])
+
+        sessions = self.sessions.frame().reset_index()
+        sessions['duration'] = sessions['end'] - sessions['start']
+        # rank() OVER (PARTITION BY device_id ORDER BY MIN(server_time))
+        sessions['session_rank'] = sessions.groupby('device')['start'].rank(method='min').astype('int64')
+        sessions['country'] = self._country(sessions['device'])
+
+        picks = self.gun_picks.frame()
+        picks = picks.assign(country=self._country(picks['device']))
+
+        return {
+            'total_users': total_users.rename('total_users').reset_index(),
+            'retained': hits.groupby(['country', 'retention_days']).size().rename('retention_count').reset_index(),
+            'cohorts': cohorts,
+            'started': self._players_by_level(self.started, 'players_started'),
+            'completed': self._players_by_level(self.completed, 'players_completed'),
+            'durations': durations.groupby(['country', 'level'])[['sum', 'count']].sum().reset_index(),
+            'sessions': sessions.groupby(['country', 'session_rank'])['duration'].agg(['sum', 'count']).reset_index(),
+            'duration_hist': self.level_buckets.frame().reset_index(),
+            'session_hist': histogram(sessions, ['country', 'session_rank'], 'duration'),
+            'gun_users': picks.groupby(['country', 'level', 'gun_name']).size().rename('users').reset_index(),
+            'gun_players': (picks[['country', 'level', 'device']].drop_duplicates()
+                            .groupby(['country', 'level']).size().rename('total_users').reset_index()),
+        }
+
+    def _players_by_level(self, rows, name):
+        df = rows.frame()
+        return (df.assign(country=self._country(df['device']))
+                  .groupby(['country', 'level']).size().rename(name).reset_index())
+
+    def results(self):
+        return finalize([self.partials()])
+
+
+_PARTIAL_KEYS = {
+    'total_users': ['country'],
+    'retained': ['country', 'retention_days'],
+    'cohorts': ['country', 'cohort_day', 'day'],
+    'started': ['country', 'level'],
+    'completed': ['country', 'level'],
+    'durations': ['country', 'level'],
+    'sessions': ['country', 'session_rank'],
+    'duration_hist': ['country', 'level', 'bucket'],
+    'session_hist': ['country', 'session_rank', 'bucket'],
+    'gun_users': ['country', 'level', 'gun_name'],
+    'gun_players': ['country', 'level'],
+}
+
+
+def combine(partials):
+    if len(partials) == 1:
+        return partials[0]
+    return {name: pd.concat([p[name] for p in partials], ignore_index=True)
+                    .groupby(keys, sort=False).sum().reset_index()
+            for name, keys in _PARTIAL_KEYS.items()}
+
+
+def finalize(partials):
+    """Dashboard tables, in the CSV export schemas, from one or more partials."""
+    p = combine(partials)
+
+    retention = p['retained'].merge(p['total_users'], on='country')
+    retention['retention_percent'] = (retention['retention_count'] * 100.0 / retention['total_users']).round(2)
+    retention = retention[['country', 'retention_days', 'total_users', 'retention_count', 'retention_percent']]
+
+    cohorts = p['cohorts'].sort_values(['country', 'cohort_day', 'day']).reset_index(drop=True)
+    cohorts = cohorts[['country']].assign(cohort_date=to_dates(cohorts['cohort_day']), day=cohorts['day'],
+                                          users=cohorts['users'])
+
+    loserate = p['started'].merge(p['completed'], on=['country', 'level'])
+    loserate['churn_rate'] = ((loserate['players_started'] - loserate['players_completed'])
+                              / loserate['players_started'] * 100)
+    loserate = loserate.sort_values(['country', 'level']).reset_index(drop=True)
+    lose_users = loserate[['country', 'level', 'players_started']].assign(
+        players_churned=loserate['players_started'] - loserate['players_completed'])
+
+    # Sum and count travel with the means so that any selection of cells
+    # can be merged exactly downstream
+    durations = p['durations'].loc[p['durations']['count'] > 0]
+    avg_dur_lev = durations[['country', 'level']].assign(
+        avg_duration=durations['sum'] / durations['count'],
+        duration_sum=durations['sum'], duration_count=durations['count'])
+
+    sessions = p['sessions']
+    avg_dur_sess = sessions[['country', 'session_rank']].assign(
+        avg_session_duration=sessions['sum'] / sessions['count'],
+        duration_sum=sessions['sum'], duration_count=sessions['count'])
+
+    guns = p['gun_users'].merge(p['gun_players'], on=['country', 'level'])
+    guns['percentage'] = guns['users'] / guns['total_users'] * 100
+    guns = guns.sort_values(['country', 'level', 'percentage'], ascending=[True, True, False])
+
+    return {
+        'retention': retention.sort_values(['country', 'retention_days']).reset_index(drop=True),
+        'loserate': loserate,
+        'lose_users': lose_users,
+        'avg_dur_lev': avg_dur_lev.sort_values(['country', 'level']).reset_index(drop=True),
+        'avg_dur_sess': avg_dur_sess.sort_values(['country', 'session_rank']).reset_index(drop=True),
+        'popul_guns': guns[['country', 'level', 'gun_name', 'users', 'percentage']].reset_index(drop=True),
+        'dur_hist_lev': p['duration_hist'].sort_values(['country', 'level', 'bucket']).reset_index(drop=True),
+        'dur_hist_sess': p['session_hist'].sort_values(['country', 'session_rank', 'bucket']).reset_index(drop=True),
+        'cohorts': cohorts,
+    }
+
+
+def read_events(path, chunksize=500_000):
+    return pd.read_csv(path, chunksize=chunksize, keep_default_na=False, na_values=[''],
+                       dtype={'device_id': str, 'session': str, 'event': str, 'extra': str})
+
+
+def run(events_path, devices_path, chunksize=500_000, sketches=False):
+    devices = read_csv(devices_path)[DEVICE_COLUMNS]
+    devices['device_id'] = devices['device_id'].astype(str)
+    engine = MetricsEngine(devices, sketches=sketches)
+    for chunk in read_events(events_path, chunksize):
+        engine.feed(chunk)
+    if sketches:
+        return engine.results(), engine.sketches.store()
+    return engine.results()
+
+
+def output_name(name, stamp=None):
+    if name == 'retention':
+        stamp = stamp or time.strftime('%Y%m%d%H%M')
+        return f'retention_count_total_users_{stamp}.csv'
+    return name + '.csv'
+
+
+def write(results, data_dir=DATA_DIR, stamp=None):
+    os.makedirs(data_dir, exist_ok=True)
+    paths = []
+    for name, df in results.items():
+        path = os.path.join(data_dir, output_name(name, stamp))
+        tmp = path + '.tmp'
+        df.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute the dashboard datasets from raw events/devices exports')
+    parser.add_argument('events')
+    parser.add_argument('devices')
+    parser.add_argument('--out', default=DATA_DIR)
+    parser.add_argument('--chunksize', type=int, default=500_000)
+    parser.add_argument('--sketches', action='store_true', help='also write distinct-device sketches')
+    args = parser.parse_args()
+
+    results = run(args.events, args.devices, args.chunksize, sketches=args.sketches)
+    if args.sketches:
+        results, store = results
+        path = os.path.join(args.out, os.path.basename(SKETCH_FILE))
+        store.save(path)
+        print(path)
+    for path in write(results, args.out):
+        print(path)
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+from loader import DATA_DIR, BuiltCache, load
+
+
+class GunPopularity:
+    """country x level x gun user counts for the "Popularity of guns" section.
+
+    Shares are weighted by users: for a country set the share of a gun on a
+    level is the sum of its users over the sum of the level's players, rather
+    than a plain mean of per-country percentages.
+    """
+
+    def __init__(self, df):
+        countries = np.asarray(df['country'].astype(object).fillna(''), dtype=str)
+        guns = np.asarray(df['gun_name'].astype(object).fillna(''), dtype=str)
+        self.countries = np.unique(countries)
+        self.levels = np.sort(df['level'].unique()).astype(np.int64)
+        self.guns = np.unique(guns)
+        self._country_pos = {c: i for i, c in enumerate(self.countries)}
+
+        ci = np.searchsorted(self.countries, countries)
+        li = np.searchsorted(self.levels, df['level'].to_numpy())
+        gi = np.searchsorted(self.guns, guns)
+        users = df['users'].to_numpy(np.int64)
+
+        shape = (len(self.countries), len(self.levels))
+        self.users = np.zeros(shape + (len(self.guns),), dtype=np.int32)
+        np.add.at(self.users, (ci, li, gi), users)
+
+        # A player can start a level with several guns, so the level's player
+        # count is recovered from users / percentage rather than summed up
+        pct = df['percentage'].to_numpy(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            total = np.where(pct > 0, np.rint(users * 100.0 / pct), 0)
+        self.players = np.zeros(shape, dtype=np.int64)
+        np.maximum.at(self.players, (ci, li), total.astype(np.int64))
+
+        self.total_users = self.users.sum(axis=0, dtype=np.int64)
+        self.total_players = self.players.sum(axis=0)
+        for array in (self.users, self.players, self.total_users, self.total_players):
+            array.setflags(write=False)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.users, self.players, self.total_users, self.total_players))
+
+    @property
+    def max_level(self):
+        return int(self.levels[-1]) if len(self.levels) else 1
+
+    def top(self, countries, level_min, level_max, n):
+        lo = np.searchsorted(self.levels, level_min, side='left')
+        hi = max(lo, np.searchsorted(self.levels, level_max, side='right'))
+        if countries is None or 'all' in countries:
+            users, players = self.total_users[lo:hi], self.total_players[lo:hi]
+        else:
+            rows = [self._country_pos[c] for c in countries if c in self._country_pos]
+            users = self.users[rows, lo:hi].sum(axis=0, dtype=np.int64)
+            players = self.players[rows, lo:hi].sum(axis=0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = np.where(players[:, None] > 0, users * 100.0 / players[:, None], 0.0)
+        share[users == 0] = -1.0
+
+        # One partial selection for the N best guns of every level, then a
+        # sort of just those N columns
+        k = min(n, len(self.guns))
+        if k == 0:
+            return pd.DataFrame(columns=['level', 'gun_name', 'popularity'])
+        if k < len(self.guns):
+            idx = np.argpartition(-share, k - 1, axis=1)[:, :k]
+        else:
+            idx = np.broadcast_to(np.arange(k), (len(share), k))
+        picked = np.take_along_axis(share, idx, axis=1)
+        order = np.argsort(-picked, axis=1, kind='stable')
+        idx = np.take_along_axis(idx, order, axis=1)
+        picked = np.take_along_axis(picked, order, axis=1)
+
+        level_idx = np.repeat(np.arange(len(share)), k)
+        keep = picked.ravel() >= 0
+        return pd.DataFrame({
+            'level': self.levels[lo:hi][level_idx][keep],
+            'gun_name': self.guns[idx.ravel()][keep],
+            'popularity': picked.ravel()[keep],
+        })
+
+
+_built = BuiltCache()
+
+
+def load_guns(data_dir=DATA_DIR, days=None):
+    df = load('popul_guns', data_dir, days)
+    return _built.get((data_dir, 'popul_guns', days is not None), df, GunPopularity)
+
+
+def memory_usage():
+    return _built.memory_usage()
+
+
+def forget(data_dir):
+    _built.forget(data_dir)
@@ -0,0 +1,310 @@
+import argparse
+import os
+import pickle
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from cohorts import COHORT_DAYS, to_dates, to_days
+from engine import RETENTION_DAYS, _GUN_RE, _LEVEL_TNT_RE, _to_seconds, read_events, write
+from loader import DATA_DIR, read_csv
+from quantiles import bucket_of
+
+STATE_FILE = os.path.join(DATA_DIR, 'engine_state.pkl')
+
+_NO_DAY = np.iinfo(np.int64).max
+# Days after the first session that are tracked per device, for the cohort
+# matrix and RETENTION_DAYS; the first day can only move earlier
+_WINDOW = COHORT_DAYS + 1
+
+
+def _pair_keys(device, level):
+    return (np.asarray(device, dtype=np.int64) << 32) | (np.asarray(level, dtype=np.int64) & 0xFFFFFFFF)
+
+
+def _new_keys(seen, keys):
+    fresh = [k for k in np.unique(keys).tolist() if k not in seen]
+    seen.update(fresh)
+    return np.array(fresh, dtype=np.int64)
+
+
+class IncrementalState:
+    """Intermediate state of MetricsEngine that new event batches fold into.
+
+    Keeps the first day and a bitmask of the following days' activity per
+    device, the distinct (device, level) and (device, level, gun) keys already
+    counted, running duration sums and per-device session spans. Folding a
+    batch only touches the devices and keys it contains, and ``results``
+    builds the tables from per-cell counters.
+    """
+
+    def __init__(self):
+        self.device_pos = {}
+        self.countries = []
+        self.country_pos = {}
+        self.device_country = np.empty(0, dtype=np.int32)
+        self.first_day = np.empty(0, dtype=np.int64)
+        self.day_mask = np.empty(0, dtype=np.uint32)
+
+        self.total_users = Counter()
+        self.retained = Counter()
+        self.cohorts = Counter()
+        self.started = set()
+        self.completed = set()
+        self.players_started = Counter()
+        self.players_completed = Counter()
+        self.duration = {}
+        self.duration_hist = Counter()
+        self.gun_pos = {}
+        self.guns = []
+        self.gun_seen = set()
+        self.gun_level_seen = set()
+        self.gun_users = Counter()
+        self.gun_players = Counter()
+        self.sessions = {}
+        self.session_stats = {}
+        self.session_hist = Counter()
+        self.batches = 0
+
+    def add_devices(self, devices):
+        ids = devices['device_id'].astype(str).to_numpy()
+        fresh = [i for i, d in enumerate(ids) if d not in self.device_pos]
+        if not fresh:
+            return
+        codes = []
+        for country in devices['country'].astype(object).fillna('').to_numpy()[fresh]:
+            if country not in self.country_pos:
+                self.country_pos[country] = len(self.countries)
+                self.countries.append(country)
+            codes.append(self.country_pos[country])
+        for d in ids[fresh]:
+            self.device_pos[d] = len(self.device_pos)
+        self.device_country = np.concatenate([self.device_country, np.array(codes, dtype=np.int32)])
+        self.first_day = np.concatenate([self.first_day, np.full(len(fresh), _NO_DAY, dtype=np.int64)])
+        self.day_mask = np.concatenate([self.day_mask, np.zeros(len(fresh), dtype=np.uint32)])
+
+    def _contribution(self, devices, sign):
+        # Every active day in the devices' windows, per install cohort
+        bits = (self.day_mask[devices][:, None] >> np.arange(_WINDOW, dtype=np.uint32)) & 1 == 1
+        row, offset = np.nonzero(bits)
+        cells = pd.DataFrame({'country': self.device_country[devices[row]],
+                              'first': self.first_day[devices[row]], 'day': offset})
+        for (c, first, day), n in cells.value_counts().items():
+            self.cohorts[(self.countries[c], int(first), int(day))] += sign * int(n)
+            if day in RETENTION_DAYS:
+                self.retained[(self.countries[c], int(day))] += sign * int(n)
+
+    def _fold_retention(self, device, day):
+        batch = pd.DataFrame({'device': device, 'day': day}).drop_duplicates()
+        first = batch.groupby('device')['day'].min()
+        devices = first.index.to_numpy()
+        old_first = self.first_day[devices]
+
+        self._contribution(devices, -1)
+        new = old_first == _NO_DAY
+        for c, n in zip(*np.unique(self.device_country[devices[new]], return_counts=True)):
+            self.total_users[self.countries[c]] += int(n)
+
+        new_first = np.minimum(old_first, first.to_numpy())
+        shift = np.where(new, 0, old_first - new_first)
+        mask = self.day_mask[devices].astype(np.int64)
+        mask = np.where(shift < _WINDOW, mask << np.minimum(shift, _WINDOW), 0) & ((1 << _WINDOW) - 1)
+        self.first_day[devices] = new_first
+        self.day_mask[devices] = mask
+
+        rel = batch['day'].to_numpy() - self.first_day[batch['device'].to_numpy()]
+        inside = rel < _WINDOW
+        np.bitwise_or.at(self.day_mask, batch['device'].to_numpy()[inside],
+                         (1 << rel[inside]).astype(np.uint32))
+        self._contribution(devices, +1)
+
+    def _count_pairs(self, counter, keys):
+        if not len(keys):
+            return
+        device = keys >> 32
+        level = (keys & 0xFFFFFFFF).astype(np.uint32).astype(np.int32)
+        df = pd.DataFrame({'country': self.device_country[device], 'level': level})
+        for (c, lv), n in df.value_counts().items():
+            counter[(self.countries[c], int(lv))] += int(n)
+
+    def _fold_sessions(self, device, session, server_time):
+        spans = pd.DataFrame({'device': device, 'session': session, 't': server_time}).groupby(
+            ['device', 'session'])['t'].agg(['min', 'max'])
+        touched = {}
+        for (d, s), start, end in zip(spans.index, spans['min'].to_numpy(), spans['max'].to_numpy()):
+            touched.setdefault(int(d), []).append((s, int(start), int(end)))
+
+        for d, updates in touched.items():
+            country = self.countries[self.device_country[d]]
+            own = self.sessions.setdefault(d, {})
+            self._session_contribution(country, own, -1)
+            for s, start, end in updates:
+                if s in own:
+                    start, end = min(start, own[s][0]), max(end, own[s][1])
+                own[s] = (start, end)
+            self._session_contribution(country, own, +1)
+
+    def _session_contribution(self, country, own, sign):
+        if not own:
+            return
+        starts = np.array([v[0] for v in own.values()], dtype=np.int64)
+        # rank() with ties sharing the lowest rank, as in code_5
+        ranks = np.searchsorted(np.sort(starts), starts, side='left') + 1
+        spans = [end - start for start, end in own.values()]
+        for span, rank, bucket in zip(spans, ranks.tolist(), bucket_of(spans).tolist()):
+            stat = self.session_stats.setdefault((country, rank), [0, 0])
+            stat[0] += sign * span
+            stat[1] += sign
+            self.session_hist[(country, rank, bucket)] += sign
+
+    def fold(self, events):
+        device = pd.Series(events['device_id'].astype(str)).map(self.device_pos)
+        known = device.notna().to_numpy()
+        events = events.loc[known]
+        device = device.to_numpy()[known].astype(np.int64)
+        if not len(events):
+            return
+        self.batches += 1
+
+        self._fold_retention(device, to_days(events['server_date']).to_numpy())
+
+        event = events['event'].to_numpy()
+        level = pd.to_numeric(events['level'], errors='coerce').fillna(0).astype('int64').to_numpy()
+        started = event == 'level_started'
+        completed = event == 'level_completed'
+        self._count_pairs(self.players_started, _new_keys(self.started, _pair_keys(device[started], level[started])))
+        self._count_pairs(self.players_completed,
+                          _new_keys(self.completed, _pair_keys(device[completed], level[completed])))
+
+        dur = pd.DataFrame({
+            'country': self.device_country[device[completed]], 'level': level[completed],
+            'param1': pd.to_numeric(events['param1'], errors='coerce').to_numpy()[completed]})
+        for (c, lv), row in dur.groupby(['country', 'level'])['param1'].agg(['sum', 'count']).iterrows():
+            stat = self.duration.setdefault((self.countries[c], int(lv)), [0.0, 0])
+            stat[0] += float(row['sum'])
+            stat[1] += int(row['count'])
+        dur = dur.loc[dur['param1'].notna()]
+        for (c, lv, b), n in dur.assign(bucket=bucket_of(dur['param1'])).value_counts(
+                ['country', 'level', 'bucket']).items():
+            self.duration_hist[(self.countries[c], int(lv), int(b))] += int(n)
+
+        self._fold_sessions(device, events['session'].to_numpy(), _to_seconds(events['server_time']).to_numpy())
+
+        extra = events['extra'].astype(object).fillna('').astype(str)[started]
+        gun = extra.str.extract(_GUN_RE, expand=False).fillna('').to_numpy()
+        level_tnt = pd.to_numeric(extra.str.extract(_LEVEL_TNT_RE, expand=False), errors='coerce').fillna(0)
+        level_tnt = level_tnt.astype('int64').to_numpy()
+        for g in set(gun.tolist()) - self.gun_pos.keys():
+            self.gun_pos[g] = len(self.guns)
+            self.guns.append(g)
+        gun_code = np.array([self.gun_pos[g] for g in gun.tolist()], dtype=np.int64)
+        pair = _pair_keys(device[started], level_tnt)
+        self._count_pairs(self.gun_players, _new_keys(self.gun_level_seen, pair))
+        picks = pd.DataFrame({'pair': pair, 'gun': gun_code}).drop_duplicates()
+        for p, g in zip(picks['pair'].tolist(), picks['gun'].tolist()):
+            if (p, g) in self.gun_seen:
+                continue
+            self.gun_seen.add((p, g))
+            key = (self.countries[self.device_country[p >> 32]], int(np.int32(np.uint32(p & 0xFFFFFFFF))),
+                   self.guns[g])
+            self.gun_users[key] += 1
+
+    def results(self):
+        retention = pd.DataFrame(
+            [(c, d, self.total_users[c], n) for (c, d), n in self.retained.items() if n > 0],
+            columns=['country', 'retention_days', 'total_users', 'retention_count'])
+        retention['retention_percent'] = (retention['retention_count'] * 100.0 / retention['total_users']).round(2)
+        retention = retention.sort_values(['country', 'retention_days']).reset_index(drop=True)
+
+        cohorts = pd.DataFrame(
+            [(*key, n) for key, n in self.cohorts.items() if n > 0],
+            columns=['country', 'cohort_day', 'day', 'users']).sort_values(['country', 'cohort_day', 'day'])
+        cohorts = cohorts[['country']].assign(cohort_date=to_dates(cohorts['cohort_day']), day=cohorts['day'],
+                                              users=cohorts['users'])
+
+        loserate = pd.DataFrame(
+            [(c, lv, n, self.players_completed[(c, lv)]) for (c, lv), n in self.players_started.items()
+             if self.players_completed[(c, lv)] > 0],
+            columns=['country', 'level', 'players_started', 'players_completed'])
+        loserate['churn_rate'] = ((loserate['players_started'] - loserate['players_completed'])
+                                  / loserate['players_started'] * 100)
+        loserate = loserate.sort_values(['country', 'level']).reset_index(drop=True)
+        lose_users = loserate[['country', 'level', 'players_started']].assign(
+            players_churned=loserate['players_started'] - loserate['players_completed'])
+
+        avg_dur_lev = pd.DataFrame(
+            [(c, lv, s / n, s, n) for (c, lv), (s, n) in self.duration.items() if n > 0],
+            columns=['country', 'level', 'avg_duration', 'duration_sum', 'duration_count'],
+        ).sort_values(['country', 'level'])
+
+        avg_dur_sess = pd.DataFrame(
+            [(c, r, s / n, s, n) for (c, r), (s, n) in self.session_stats.items() if n > 0],
+            columns=['country', 'session_rank', 'avg_session_duration', 'duration_sum', 'duration_count'],
+        ).sort_values(['country', 'session_rank'])
+
+        dur_hist_lev = pd.DataFrame(
+            [(*key, n) for key, n in self.duration_hist.items() if n > 0],
+            columns=['country', 'level', 'bucket', 'count']).sort_values(['country', 'level', 'bucket'])
+        dur_hist_sess = pd.DataFrame(
+            [(*key, n) for key, n in self.session_hist.items() if n > 0],
+            columns=['country', 'session_rank', 'bucket', 'count']).sort_values(['country', 'session_rank', 'bucket'])
+
+        popul_guns = pd.DataFrame(
+            [(c, lv, g, n, n / self.gun_players[(c, lv)] * 100) for (c, lv, g), n in self.gun_users.items()],
+            columns=['country', 'level', 'gun_name', 'users', 'percentage'])
+        popul_guns = popul_guns.sort_values(['country', 'level', 'percentage'], ascending=[True, True, False])
+
+        return {
+            'retention': retention,
+            'loserate': loserate,
+            'lose_users': lose_users,
+            'avg_dur_lev': avg_dur_lev.reset_index(drop=True),
+            'avg_dur_sess': avg_dur_sess.reset_index(drop=True),
+            'popul_guns': popul_guns.reset_index(drop=True),
+            'dur_hist_lev': dur_hist_lev.reset_index(drop=True),
+            'dur_hist_sess': dur_hist_sess.reset_index(drop=True),
+            'cohorts': cohorts.reset_index(drop=True),
+        }
+
+    def save(self, path=STATE_FILE):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=STATE_FILE):
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if not hasattr(state, 'session_hist'):
+            # Saved before duration histograms were tracked; the past batches
+            # would be missing from them
+            raise ValueError(f'{path} predates duration histograms, rebuild it from the full events export')
+        if not hasattr(state, 'cohorts'):
+            raise ValueError(f'{path} predates cohort tracking, rebuild it from the full events export')
+        return state
+
+
+def update(events_path, devices_path, state_path=STATE_FILE, data_dir=DATA_DIR, chunksize=500_000):
+    state = IncrementalState.load(state_path)
+    state.add_devices(read_csv(devices_path))
+    for chunk in read_events(events_path, chunksize):
+        state.fold(chunk)
+    state.save(state_path)
+    return write(state.results(), data_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fold a new events batch into the saved engine state')
+    parser.add_argument('events')
+    parser.add_argument('devices')
+    parser.add_argument('--state', default=STATE_FILE)
+    parser.add_argument('--out', default=DATA_DIR)
+    parser.add_argument('--chunksize', type=int, default=500_000)
+    args = parser.parse_args()
+
+    for path in update(args.events, args.devices, args.state, args.out, args.chunksize):
+        print(path)
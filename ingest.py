@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from cohorts import COHORT_DAYS
+from loader import DATA_DIR
+from snapshot import SCHEMAS, compact, write_snapshot
+
+QUARANTINE_DIR = 'quarantine'
+REPORT_FILE = 'report.json'
+
+# Level ids past this are tracking bugs, such as 194000 and 1940010000
+MAX_LEVEL = 100_000
+MAX_SESSION_RANK = 100_000
+
+# Columns that identify a row; a second row with the same key is quarantined
+KEYS = {
+    'retention': ['country', 'retention_days'],
+    'loserate': ['country', 'level'],
+    'lose_users': ['country', 'level'],
+    'avg_dur_lev': ['country', 'level'],
+    'avg_dur_sess': ['country', 'session_rank'],
+    'popul_guns': ['country', 'level', 'gun_name'],
+    'dur_hist_lev': ['country', 'level', 'bucket'],
+    'dur_hist_sess': ['country', 'session_rank', 'bucket'],
+    'cohorts': ['country', 'cohort_date', 'day'],
+}
+
+# Allowed (min, max) per column, None for open-ended; count columns of the
+# schemas not listed here must not be negative
+RANGES = {
+    'level': (1, MAX_LEVEL),
+    'session_rank': (1, MAX_SESSION_RANK),
+    'retention_days': (0, COHORT_DAYS),
+    'day': (0, COHORT_DAYS),
+    'retention_percent': (0, 100),
+    'percentage': (0, 100),
+    'churn_rate': (None, None),
+    'avg_duration': (0, None),
+    'avg_session_duration': (0, None),
+    'duration_sum': (0, None),
+}
+
+REASONS = ['type', 'missing', 'range', 'duplicate']
+
+
+def validate(name, df):
+    """Splits an export into typed clean rows and quarantined rows.
+
+    Every check is one vectorized mask over the frame. A row is quarantined
+    for the first check it fails, in the order of REASONS; the quarantined
+    rows keep their raw values plus a ``reason`` column. A missing key
+    column rejects the whole export with a ValueError.
+    """
+    schema = SCHEMAS[name]
+    missing_columns = [c for c in KEYS[name] if c not in df.columns]
+    if missing_columns:
+        raise ValueError(f'{name}: missing column(s) {", ".join(missing_columns)}')
+    columns = [c for c in schema if c in df.columns]
+
+    bad = {reason: np.zeros(len(df), dtype=bool) for reason in REASONS}
+    typed = {}
+    for col in columns:
+        raw = df[col]
+        if schema[col] == 'category':
+            text = raw.astype(object)
+            bad['missing'] |= (raw.isna() | (text == '')).to_numpy()
+            continue
+        values = pd.to_numeric(raw, errors='coerce')
+        bad['missing'] |= raw.isna().to_numpy()
+        bad['type'] |= (values.isna() & raw.notna()).to_numpy()
+        numbers = values.to_numpy(np.float64)
+        low, high = RANGES.get(col, (0, None))
+        with np.errstate(invalid='ignore'):
+            if schema[col] == 'int':
+                bad['type'] |= ~np.isnan(numbers) & (numbers != np.round(numbers))
+            if low is not None:
+                bad['range'] |= numbers < low
+            if high is not None:
+                bad['range'] |= numbers > high
+        typed[col] = values
+
+    checked = df.assign(**typed)
+    failed = np.zeros(len(df), dtype=bool)
+    for reason in REASONS[:-1]:
+        failed |= bad[reason]
+    # Duplicates among the rows that passed everything else; the first wins
+    keys = checked[KEYS[name]].assign(_failed=failed)
+    bad['duplicate'] = ~failed & keys.duplicated(keep='first').to_numpy()
+    failed |= bad['duplicate']
+
+    reason = np.select([bad[r] for r in REASONS], REASONS, default='')
+    quarantined = df.loc[failed].assign(reason=reason[failed])
+    clean = compact(checked.loc[~failed].reset_index(drop=True), schema)
+    return clean, quarantined
+
+
+_report_lock = threading.Lock()
+
+
+def write_report(name, clean, quarantined, directory, source=None):
+    """Quarantined rows as ``<name>.csv`` plus a line in report.json."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + '.csv')
+    if len(quarantined):
+        quarantined.to_csv(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+    elif os.path.exists(path):
+        os.remove(path)
+    report_path = os.path.join(directory, REPORT_FILE)
+    with _report_lock:
+        report = read_report(directory)
+        report[name] = {
+            'checked': time.strftime('%Y-%m-%dT%H:%M:%S'), 'source': source,
+            'rows': len(clean) + len(quarantined), 'clean': len(clean),
+            'quarantined': {r: int(n) for r, n in quarantined['reason'].value_counts().items()},
+        }
+        with open(report_path + '.tmp', 'w') as f:
+            json.dump(report, f, indent=1, sort_keys=True)
+        os.replace(report_path + '.tmp', report_path)
+    return path
+
+
+def read_report(directory):
+    try:
+        with open(os.path.join(directory, REPORT_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_clean(name, df, path, quarantine_dir=None, source=None):
+    # The only way exports become snapshots, so every snapshot is clean
+    clean, quarantined = validate(name, df)
+    write_snapshot(name, clean, path)
+    if quarantine_dir is not None:
+        write_report(name, clean, quarantined, quarantine_dir, source)
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Validate the exports and write clean snapshots and a quarantine report')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    args = parser.parse_args()
+
+    from snapshot import convert_all
+    convert_all(args.data_dir)
+    for name, entry in read_report(os.path.join(args.data_dir, QUARANTINE_DIR)).items():
+        print(f"{name:<15}{entry['rows']:>10,} rows{entry['clean']:>10,} clean  {entry['quarantined'] or ''}")
@@ -0,0 +1,110 @@
+import io
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+import pyarrow as pa
+
+LOG_FILE = os.environ.get('DASHBOARD_PROFILE_LOG', 'profile.jsonl')
+
+_write_lock = threading.Lock()
+
+
+def figure_bytes(fig):
+    # What st.plotly_chart sends to the browser
+    return len(fig.to_json().encode())
+
+
+def table_bytes(df):
+    # st.dataframe ships the frame as Arrow IPC
+    sink = io.BytesIO()
+    table = pa.Table.from_pandas(df)
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.tell()
+
+
+def rss_bytes():
+    # Resident set size of this process; falls back to the peak off Linux
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Profiler:
+    """Per-rerun timings of each section's phases plus payload sizes."""
+
+    enabled = True
+
+    def __init__(self, log_path=LOG_FILE):
+        self.log_path = log_path
+        self.started = time.perf_counter()
+        self.rows = []
+
+    @contextmanager
+    def phase(self, section, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.rows.append({'section': section, 'phase': name, 'seconds': time.perf_counter() - start})
+
+    def payload(self, section, obj):
+        size = table_bytes(obj) if hasattr(obj, 'columns') else figure_bytes(obj)
+        self.rows.append({'section': section, 'phase': 'payload', 'bytes': size})
+        return obj
+
+    def table(self):
+        df = pd.DataFrame(self.rows, columns=['section', 'phase', 'seconds', 'bytes'])
+        timed = df.loc[df['seconds'].notna()]
+        out = timed.pivot_table(index='section', columns='phase', values='seconds', aggfunc='sum', sort=False)
+        out = (out * 1000).round(1).add_suffix(' ms')
+        out['payload KB'] = (df.groupby('section', sort=False)['bytes'].sum() / 1024).round(1)
+        return out
+
+    def flush(self):
+        record = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'total_s': time.perf_counter() - self.started,
+            'rss_bytes': rss_bytes(),
+            'phases': self.rows,
+        }
+        with _write_lock, open(self.log_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+class NullProfiler:
+    """Stand-in used when profiling is off: no timing, no payload encoding."""
+
+    enabled = False
+    _context = nullcontext()
+
+    def phase(self, section, name):
+        return self._context
+
+    def payload(self, section, obj):
+        return obj
+
+    def flush(self):
+        pass
+
+
+_null = NullProfiler()
+
+
+def start(enabled):
+    return Profiler() if enabled else _null
+
+
+def profiling_requested(query_params=None):
+    if os.environ.get('DASHBOARD_PROFILE'):
+        return True
+    return bool(query_params) and query_params.get('debug') in ('1', 'true')
@@ -0,0 +1,256 @@
+import fnmatch
+import glob
+import os
+import threading
+import time
+
+import pandas as pd
+
+DATA_DIR = 'data'
+SNAPSHOT_EXT = '.arrow'
+# 'csv' reads the exports in data/; see sources.source_from_url for the others
+SOURCE = os.environ.get('DASHBOARD_SOURCE', 'csv')
+
+# Exports in data/; wildcard names resolve to the most recent file
+DATASETS = {
+    'retention': 'retention_count_total_users_*.csv',
+    'loserate': 'loserate.csv',
+    'lose_users': 'lose_users.csv',
+    'avg_dur_lev': 'avg_dur_lev.csv',
+    'avg_dur_sess': 'avg_dur_sess.csv',
+    'popul_guns': 'popul_guns.csv',
+    'dur_hist_lev': 'dur_hist_lev.csv',
+    'dur_hist_sess': 'dur_hist_sess.csv',
+    'cohorts': 'cohorts.csv',
+}
+
+
+def resolve_path(name, data_dir=DATA_DIR):
+    pattern = os.path.join(data_dir, DATASETS.get(name, name))
+    if not glob.has_magic(pattern):
+        return pattern
+    matches = sorted(glob.glob(pattern))
+    if not matches:
+        raise FileNotFoundError(pattern)
+    return matches[-1]
+
+
+def read_csv(path):
+    # 'NA' is Namibia's country code, not a missing value
+    return pd.read_csv(path, keep_default_na=False, na_values=[''])
+
+
+def read_any(path):
+    if path.endswith(SNAPSHOT_EXT):
+        from snapshot import read_snapshot
+        return read_snapshot(path)
+    return read_csv(path)
+
+
+def dataset_of(path):
+    base = os.path.basename(path)
+    for name, pattern in DATASETS.items():
+        if base == name + SNAPSHOT_EXT or fnmatch.fnmatch(base, pattern):
+            return name
+    return None
+
+
+def read_export(path):
+    # Snapshots were validated when they were written; a raw export is
+    # validated here, once per file version as the cache keeps the result
+    df = read_any(path)
+    name = dataset_of(path)
+    if path.endswith(SNAPSHOT_EXT) or name is None:
+        return df
+    from ingest import validate
+    return validate(name, df)[0]
+
+
+def _newest(name, data_dir):
+    # A columnar snapshot wins over the CSV it was built from unless the CSV
+    # has been re-exported since
+    snap_path = os.path.join(data_dir, name + SNAPSHOT_EXT)
+    try:
+        snap_mtime = os.stat(snap_path).st_mtime_ns
+    except OSError:
+        return resolve_path(name, data_dir)
+    try:
+        csv_path = resolve_path(name, data_dir)
+        csv_mtime = os.stat(csv_path).st_mtime_ns
+    except FileNotFoundError:
+        # Snapshot directories hold no CSVs at all
+        return snap_path
+    if csv_mtime > snap_mtime:
+        return csv_path
+    return snap_path
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class CsvCache:
+    """Parsed exports kept in memory until the file's mtime or size changes.
+
+    The returned frames are shared between reruns and sessions, so callers
+    must treat them as read-only.
+    """
+
+    def __init__(self, reader=read_export):
+        self.reader = reader
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load_seconds = {}
+
+    def get(self, path):
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry[1]
+
+        start = time.perf_counter()
+        df = self.reader(path)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self._entries[path] = (key, df)
+            self.misses += 1
+            self.load_seconds[path] = elapsed
+        return df
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+
+    def forget(self, data_dir):
+        # Drops the files of one directory, e.g. a retired snapshot
+        with self._lock:
+            for path in [p for p in self._entries if os.path.dirname(p) == os.path.normpath(data_dir)]:
+                del self._entries[path]
+                self.load_seconds.pop(path, None)
+
+    def memory_usage(self):
+        with self._lock:
+            frames = {path: entry[1] for path, entry in self._entries.items()}
+        return {path: frame_bytes(df) for path, df in frames.items()}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'load_seconds': dict(self.load_seconds),
+            }
+
+
+class BuiltCache:
+    """Objects built from a loaded frame, rebuilt only when the loader hands back a new one.
+
+    Keys start with the data directory and the dataset name and end with
+    whether the frame covers a date range; the objects report ``nbytes``.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, df, build):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is df:
+                return entry[1]
+        built = build(df)
+        with self._lock:
+            self._entries[key] = (df, built)
+        return built
+
+    def forget(self, data_dir):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == data_dir]:
+                del self._entries[key]
+
+    def memory_usage(self):
+        with self._lock:
+            return {key[1] + (' (dates)' if key[-1] else ''): entry[1].nbytes for key, entry in self._entries.items()}
+
+
+_cache = CsvCache()
+
+
+def load_export(name, data_dir=DATA_DIR):
+    return _cache.get(_newest(name, data_dir))
+
+
+def export_version(name, data_dir=DATA_DIR):
+    # Identifies the file load_export() would return without reading it
+    path = _newest(name, data_dir)
+    st = os.stat(path)
+    return path, st.st_mtime_ns, st.st_size
+
+
+def uses_source(data_dir):
+    # Other directories, such as the snapshots of refresh.py, are plain files
+    return SOURCE != 'csv' and data_dir == DATA_DIR
+
+
+_checked = {}
+_checked_lock = threading.Lock()
+
+
+def _validated(name, df):
+    # Query results are validated once per result frame the source caches
+    with _checked_lock:
+        entry = _checked.get(name)
+        if entry is not None and entry[0] is df:
+            return entry[1]
+    from ingest import validate
+    clean = validate(name, df)[0]
+    with _checked_lock:
+        _checked[name] = (df, clean)
+    return clean
+
+
+def load(name, data_dir=DATA_DIR, days=None):
+    # days=(first, last) reads the per-day store instead of the full export
+    if days is not None:
+        from partitions import get_store
+        return get_store(data_dir).read(name, *days)
+    if uses_source(data_dir):
+        from sources import get_source
+        return _validated(name, get_source(SOURCE).fetch(name))
+    return load_export(name, data_dir)
+
+
+def version(name, data_dir=DATA_DIR, days=None):
+    if days is not None:
+        from partitions import get_store
+        return get_store(data_dir).version(name, *days)
+    if uses_source(data_dir):
+        from sources import get_source
+        return get_source(SOURCE).version(name)
+    return export_version(name, data_dir)
+
+
+def cache_stats():
+    return _cache.stats()
+
+
+def forget(data_dir):
+    _cache.forget(data_dir)
+
+
+def memory_usage():
+    from partitions import memory_usage as partition_usage
+    if SOURCE != 'csv':
+        from sources import get_source
+        return {**get_source(SOURCE).cache.memory_usage(), **partition_usage()}
+    return {**_cache.memory_usage(), **partition_usage()}
@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+# Snapshots built mid-run would be timed as well; a test of the refresh
+# worker sets this explicitly
+os.environ.setdefault('DASHBOARD_REFRESH_SECONDS', '0')
+
+from instrument import rss_bytes  # noqa: E402
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+
+
+@contextmanager
+def concurrent_sessions():
+    """Lets several AppTest sessions run at once in this process, until exit.
+
+    AppTest is written for one session at a time: for the length of a run
+    it installs a mock runtime and patches the config into test mode, undoing
+    both afterwards, and it compiles the script on every run, which isn't
+    thread-safe on every Python. Inside the block the runtime a finished run
+    leaves behind stays visible, test mode stays on and compiling is
+    serialized; app.py itself runs unchanged. Streamlit is restored on exit.
+    """
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1.util import build_mock_config_get_option
+
+    last = []
+
+    def instance(cls):
+        if cls._instance is not None:
+            last[:] = [cls._instance]
+        if not last:
+            raise RuntimeError("Runtime hasn't been created!")
+        return last[0]
+
+    compile_lock = threading.Lock()
+    get_bytecode = ScriptCache.get_bytecode
+
+    def locked_get_bytecode(self, script_path):
+        with compile_lock:
+            return get_bytecode(self, script_path)
+
+    saved = (config.get_option, Runtime.__dict__['instance'], Runtime.__dict__['exists'], get_bytecode)
+    config.get_option = build_mock_config_get_option({'global.appTest': True})
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or bool(last))
+    ScriptCache.get_bytecode = locked_get_bytecode
+    try:
+        yield
+    finally:
+        config.get_option, Runtime.instance, Runtime.exists, ScriptCache.get_bytecode = saved
+
+
+def _pages(at):
+    return {info['url_pathname'] or 'retention': h for h, info in at._registered_pages.items()}
+
+
+def _countries(at, rng):
+    widget = at.multiselect[0]
+    options = [o for o in widget.options if o != 'all']
+    if 'all' in widget.options and rng.random() < 0.3:
+        return widget.set_value(['all'])
+    return widget.set_value(rng.sample(options, rng.randint(1, 5)))
+
+
+def _levels(at, rng):
+    low, high = at.number_input[0], at.number_input[1]
+    top = int(high.max)
+    first = rng.randint(1, top)
+    last = min(top, first + rng.choice([0, 5, 10, 50, top]))
+    low.set_value(first)
+    return high.set_value(last)
+
+
+def _top(at, rng):
+    widget = at.selectbox[0]
+    return widget.set_value(rng.choice([o for o in widget.options if o != widget.value]))
+
+
+def _day(at, rng):
+    widget = at.slider[0]
+    return widget.set_value(rng.randint(widget.min, widget.max))
+
+
+def _query(at, rng):
+    widget = next(w for w in at.checkbox if w.label.startswith('Show Query Code'))
+    return widget.set_value(not widget.value)
+
+
+# name: (widget list the action needs, action); weights follow how analysts
+# mostly change filters and only now and then look at the SQL
+ACTIONS = {
+    'countries': ('multiselect', _countries, 4),
+    'levels': ('number_input', _levels, 4),
+    'top': ('selectbox', _top, 2),
+    'day': ('slider', _day, 2),
+    'query': ('checkbox', _query, 1),
+}
+
+
+class Session:
+    """One simulated viewer: an AppTest that clicks through random sections and filters."""
+
+    def __init__(self, seed, timeout=120):
+        from streamlit.testing.v1 import AppTest
+        self.rng = random.Random(seed)
+        self.at = AppTest.from_file(APP, default_timeout=timeout)
+        self.latencies = []
+        self.errors = []
+
+    def _timed(self, step):
+        start = time.perf_counter()
+        step()
+        self.latencies.append(time.perf_counter() - start)
+        self.errors += [e.value for e in self.at.exception]
+
+    def step(self):
+        at, rng = self.at, self.rng
+        available = [(name, fn, weight) for name, (widgets, fn, weight) in ACTIONS.items() if len(getattr(at, widgets))]
+        if not available or rng.random() < 0.2:
+            # Another section
+            pages = _pages(at)
+            at._page_hash = pages[rng.choice(list(pages))]
+            self._timed(at.run)
+            return 'page'
+        name, fn, _ = rng.choices(available, weights=[w for _, _, w in available])[0]
+        self._timed(lambda: fn(at, rng).run())
+        return name
+
+    def run(self, steps):
+        self._timed(self.at.run)
+        for _ in range(steps):
+            self.step()
+        return self
+
+
+class RssSampler:
+    """Peak resident set size while running, sampled from a thread."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def run_level(sessions, steps, seed):
+    """Latency percentiles, throughput and peak RSS with ``sessions`` viewers at once."""
+    with RssSampler() as rss, ThreadPoolExecutor(sessions) as pool:
+        start = time.perf_counter()
+        done = list(pool.map(lambda i: Session(seed * 10_000 + i).run(steps), range(sessions)))
+        wall = time.perf_counter() - start
+    latencies = np.array([t for s in done for t in s.latencies])
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'sessions': sessions, 'reruns': len(latencies), 'wall_s': wall,
+        'p50_s': p50, 'p95_s': p95, 'p99_s': p99, 'max_s': latencies.max(),
+        'reruns_per_s': len(latencies) / wall, 'peak_rss_bytes': rss.peak,
+        'errors': sum(len(s.errors) for s in done),
+    }
+
+
+HEADER = (f"{'sessions':>8}{'reruns':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+          f"{'reruns/s':>10}{'peak RSS MB':>13}{'errors':>8}")
+
+
+def report(r):
+    print(f"{r['sessions']:>8}{r['reruns']:>8}{r['p50_s'] * 1000:>9.0f}{r['p95_s'] * 1000:>9.0f}"
+          f"{r['p99_s'] * 1000:>9.0f}{r['max_s'] * 1000:>9.0f}{r['reruns_per_s']:>10.1f}"
+          f"{r['peak_rss_bytes'] / 2**20:>13.0f}{r['errors']:>8}")
+
+
+def main(levels, steps, seed, warm, history):
+    records = []
+    with concurrent_sessions():
+        if warm:
+            # Visit every section once so the first level isn't timing cold loads
+            session = Session(seed)
+            session.at.run()
+            for h in _pages(session.at).values():
+                session.at._page_hash = h
+                session.at.run()
+        print(HEADER)
+        for sessions in levels:
+            records.append(run_level(sessions, steps, seed))
+            report(records[-1])
+    if history:
+        stamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+        with open(history, 'a') as f:
+            for r in records:
+                f.write(json.dumps({'time': stamp, 'steps': steps, 'seed': seed, 'warm': warm, **r}) + '\n')
+    return records
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drive simulated concurrent sessions through app.py headlessly')
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--steps', type=int, default=20, help='widget changes per session after the first load')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scale', type=int, help='run against synthetic data of this scale instead of ./data')
+    parser.add_argument('--cold', action='store_true', help='skip the warm-up visit of every section')
+    parser.add_argument('--history', help='append the results as JSON lines to this file')
+    args = parser.parse_args()
+
+    history = args.history and os.path.abspath(args.history)
+    if args.scale:
+        import synthetic
+        from engine import write
+        with tempfile.TemporaryDirectory(prefix=f'loadtest_{args.scale}x_') as root:
+            write(synthetic.generate(args.scale, args.seed), os.path.join(root, 'data'), stamp='000000000000')
+            # app.py reads ./data
+            os.chdir(root)
+            main(args.sessions, args.steps, args.seed, not args.cold, history)
+    else:
+        main(args.sessions, args.steps, args.seed, not args.cold, history)
@@ -0,0 +1,127 @@
+import threading
+from collections import OrderedDict
+
+from instrument import figure_bytes
+from loader import DATA_DIR, version
+
+MAX_BYTES = 64 * 1024 * 1024
+
+
+def output_bytes(obj):
+    if isinstance(obj, (tuple, list)):
+        return sum(output_bytes(o) for o in obj)
+    if hasattr(obj, 'nbytes'):
+        return obj.nbytes
+    if hasattr(obj, 'memory_usage'):
+        return int(obj.memory_usage(deep=True).sum())
+    return figure_bytes(obj)
+
+
+def filter_state(countries=None, levels=None, top=None, day=None):
+    """Widget values reduced to what actually changes a section's output."""
+    if countries is not None:
+        countries = ('all',) if 'all' in countries else tuple(sorted(set(countries)))
+    if levels is not None:
+        levels = tuple(int(x) for x in levels)
+    return countries, levels, top, day
+
+
+class OutputCache:
+    """Finished figures and tables, least recently used evicted past max_bytes.
+
+    Module-level, so every browser session served by this process shares
+    it; cached outputs must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, compute):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        value = compute()
+        size = output_bytes(value)
+        with self._lock:
+            if size > self.max_bytes:
+                return value
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if hasattr(value, 'on_grow'):
+                # Outputs that build parts on demand, such as a PagedTable's
+                # sort orders, report the bytes they add
+                value.on_grow = lambda nbytes: self._grow(key, value, nbytes)
+            self._entries[key] = (value, size)
+            self.size += size
+            self._evict()
+        return value
+
+    def _grow(self, key, value, nbytes):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not value:
+                return
+            self._entries[key] = (value, entry[1] + nbytes)
+            self.size += nbytes
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.size,
+            }
+
+
+_outputs = OutputCache()
+
+
+def _version(dataset, data_dir, days):
+    try:
+        return version(dataset, data_dir, days)
+    except FileNotFoundError:
+        return None
+
+
+def dataset_versions(datasets, data_dir=DATA_DIR, days=None):
+    if isinstance(datasets, str):
+        datasets = (datasets,)
+    return tuple(_version(d, data_dir, days) for d in datasets)
+
+
+def memoized(section, datasets, compute, countries=None, levels=None, top=None, day=None, days=None,
+             data_dir=DATA_DIR):
+    # A re-exported dataset or a new snapshot changes the version, so stale
+    # outputs just age out
+    key = (section, dataset_versions(datasets, data_dir, days), filter_state(countries, levels, top, day))
+    return _outputs.get(key, compute)
+
+
+def memo_stats():
+    return _outputs.stats()
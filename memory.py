@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pandas as pd
+
+import cohorts
+import cube
+import guns
+import loader
+import quantiles
+from instrument import rss_bytes
+from memo import memo_stats
+
+# Everything below except session state is held once per process and shared
+# by all sessions, so resident memory should barely move with the user count
+
+
+def dataset_report():
+    """Bytes of each shared dataset, per layer it is kept in."""
+    rows = [('frame', os.path.basename(str(path)), size) for path, size in loader.memory_usage().items()]
+    rows += [('cube', name, size) for name, size in cube.memory_usage().items()]
+    rows += [('quantiles', name, size) for name, size in quantiles.memory_usage().items()]
+    rows += [('guns', name, size) for name, size in guns.memory_usage().items()]
+    rows += [('cohorts', name, size) for name, size in cohorts.memory_usage().items()]
+    rows.append(('outputs', 'memoized sections', memo_stats()['bytes']))
+    return pd.DataFrame(rows, columns=['layer', 'dataset', 'bytes'])
+
+
+def deep_size(obj):
+    if hasattr(obj, 'memory_usage'):
+        return int(obj.memory_usage(deep=True).sum())
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(k) + deep_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(v) for v in obj)
+    return size
+
+
+def session_bytes(state):
+    """What one session keeps of its own: widget values and session state."""
+    return sum(deep_size(key) + deep_size(state[key]) for key in list(state.keys()))
+
+
+def memory_report(state=None):
+    datasets = dataset_report()
+    return {
+        'rss': rss_bytes(),
+        'shared': int(datasets['bytes'].sum()),
+        'session': 0 if state is None else session_bytes(state),
+        'datasets': datasets,
+    }
@@ -0,0 +1,105 @@
+import argparse
+import glob
+import io
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from engine import DEVICE_COLUMNS, MetricsEngine, finalize, read_events, write
+from loader import DATA_DIR, read_csv
+from sketch import SKETCH_FILE, merge_stores
+
+RANGE_BYTES = 64 * 1024 * 1024
+
+
+def byte_ranges(path, parts, range_bytes=RANGE_BYTES):
+    """Split a CSV into newline-aligned byte ranges after the header line.
+
+    Assumes no quoted field spans several lines, which holds for the events
+    export (the extra JSON is single-line).
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        body = f.tell()
+        count = max(parts, -(-(size - body) // range_bytes))
+        step = max(1, (size - body) // count)
+        bounds = [body]
+        for i in range(1, count):
+            f.seek(max(body + i * step, bounds[-1]))
+            f.readline()
+            bounds.append(min(f.tell(), size))
+        bounds.append(size)
+    ranges = [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+    return header, ranges
+
+
+def partition_of(device_ids, parts):
+    return (pd.util.hash_array(device_ids.astype(str).to_numpy(dtype=object)) % parts).astype('int64')
+
+
+def _scatter(task):
+    # Map step: parse one byte range and spill its rows into per-partition files
+    path, header, start, end, parts, spill_dir, chunksize = task
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    for n, chunk in enumerate(read_events(io.BytesIO(header + data), chunksize)):
+        for part, rows in chunk.groupby(partition_of(chunk['device_id'], parts), sort=False):
+            rows.to_pickle(os.path.join(spill_dir, str(part), f'{start}_{n}.pkl'))
+    return start
+
+
+def _aggregate(task):
+    # Reduce step: one engine per partition; partitions hold disjoint devices
+    devices_path, part_dir, sketches = task
+    devices = read_csv(devices_path)[DEVICE_COLUMNS]
+    devices['device_id'] = devices['device_id'].astype(str)
+    engine = MetricsEngine(devices, sketches=sketches)
+    for piece in sorted(glob.glob(os.path.join(part_dir, '*.pkl'))):
+        engine.feed(pd.read_pickle(piece))
+    return engine.partials(), (engine.sketches.store() if sketches else None)
+
+
+def run_parallel(events_path, devices_path, workers=None, chunksize=500_000, sketches=False):
+    workers = workers or os.cpu_count() or 1
+    header, ranges = byte_ranges(events_path, workers)
+    spill_dir = tempfile.mkdtemp(prefix='events_parts_')
+    try:
+        for part in range(workers):
+            os.makedirs(os.path.join(spill_dir, str(part)))
+        with ProcessPoolExecutor(workers) as pool:
+            list(pool.map(_scatter, [(events_path, header, a, b, workers, spill_dir, chunksize)
+                                     for a, b in ranges]))
+            done = list(pool.map(_aggregate, [(devices_path, os.path.join(spill_dir, str(part)), sketches)
+                                              for part in range(workers)]))
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    results = finalize([partials for partials, _ in done])
+    if sketches:
+        return results, merge_stores([store for _, store in done])
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compute the dashboard datasets on a process pool')
+    parser.add_argument('events')
+    parser.add_argument('devices')
+    parser.add_argument('--out', default=DATA_DIR)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunksize', type=int, default=500_000)
+    parser.add_argument('--sketches', action='store_true', help='also write distinct-device sketches')
+    args = parser.parse_args()
+
+    results = run_parallel(args.events, args.devices, args.workers, args.chunksize, sketches=args.sketches)
+    if args.sketches:
+        results, store = results
+        path = os.path.join(args.out, os.path.basename(SKETCH_FILE))
+        store.save(path)
+        print(path)
+    for path in write(results, args.out):
+        print(path)
@@ -0,0 +1,229 @@
+import argparse
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+from cohorts import COHORT_DAYS, to_dates, to_days
+from ingest import QUARANTINE_DIR, write_clean
+from loader import DATA_DIR, SNAPSHOT_EXT, frame_bytes, read_csv
+from snapshot import read_table
+
+PARTITION_DIR = os.path.join(DATA_DIR, 'partitions')
+FIRST_SEEN = 'first_seen' + SNAPSHOT_EXT
+
+# Datasets stored as one file per event day. Durations and histograms add up
+# exactly over a range of days; player counts of levels and guns are per day,
+# so a range adds up player-days. Cohort cells are filed under the day they
+# were observed (install date + days since install) and selected by install
+# date, so a new day never touches older files
+PARTITIONED = {
+    'loserate': (['country', 'level'], ['players_started', 'players_completed']),
+    'lose_users': (['country', 'level'], ['players_started', 'players_churned']),
+    'avg_dur_lev': (['country', 'level'], ['duration_sum', 'duration_count']),
+    'dur_hist_lev': (['country', 'level', 'bucket'], ['count']),
+    'popul_guns': (['country', 'level', 'gun_name'], ['users']),
+    'cohorts': (['country', 'cohort_date', 'day'], ['users']),
+}
+
+
+def day_number(day):
+    return int(to_days(pd.Series([day])).iloc[0])
+
+
+def merge(name, df):
+    """One day's table schema again, from the rows of several days."""
+    keys, values = PARTITIONED[name]
+    if name == 'cohorts':
+        # Each cell was observed on exactly one day, so no two files share it
+        return df.sort_values(keys, ignore_index=True)
+    out = df.groupby(keys, observed=True)[values].sum().reset_index()
+    if name == 'loserate':
+        out['churn_rate'] = (out['players_started'] - out['players_completed']) / out['players_started'] * 100
+    elif name == 'avg_dur_lev':
+        out.insert(2, 'avg_duration', out['duration_sum'] / out['duration_count'])
+    elif name == 'popul_guns':
+        # Players of a level are stored once per day and level, not per gun
+        players = (df[['_day', 'country', 'level', 'players']].drop_duplicates(['_day', 'country', 'level'])
+                   .groupby(['country', 'level'], observed=True)['players'].sum())
+        total = players.reindex(pd.MultiIndex.from_frame(out[['country', 'level']])).to_numpy()
+        out['percentage'] = out['users'] / total * 100
+        out = out.sort_values(['country', 'level', 'percentage'], ascending=[True, True, False], ignore_index=True)
+    return out
+
+
+class PartitionStore:
+    """Per-day Arrow files of the PARTITIONED datasets under ``root/<name>/``.
+
+    A date range is resolved against the file names, and only the matching
+    files are memory-mapped and concatenated as Arrow tables before anything
+    is converted to pandas. Days can only be appended after the last one.
+    """
+
+    def __init__(self, root=PARTITION_DIR, max_entries=8):
+        self.root = root
+        self.max_entries = max_entries
+        self._merged = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, name, day):
+        return os.path.join(self.root, name, day + SNAPSHOT_EXT)
+
+    def days(self, name):
+        try:
+            files = os.listdir(os.path.join(self.root, name))
+        except FileNotFoundError:
+            return []
+        return sorted(f[:-len(SNAPSHOT_EXT)] for f in files if f.endswith(SNAPSHOT_EXT))
+
+    def span(self):
+        """(first day, last day) over all datasets, None for an empty store."""
+        days = [d for name in PARTITIONED for d in self.days(name)]
+        return (min(days), max(days)) if days else None
+
+    def _select(self, name, start, end):
+        if name not in PARTITIONED:
+            raise FileNotFoundError(f'{name!r} is not stored by day')
+        days = self.days(name)
+        if not days:
+            raise FileNotFoundError(os.path.join(self.root, name))
+        if name == 'cohorts' and end is not None:
+            # Cohorts installed by ``end`` are observed up to COHORT_DAYS later
+            end = to_dates([day_number(end) + COHORT_DAYS])[0]
+        return [d for d in days if (start is None or d >= start) and (end is None or d <= end)]
+
+    def version(self, name, start=None, end=None):
+        out = []
+        for day in self._select(name, start, end):
+            st = os.stat(self._path(name, day))
+            out.append((day, st.st_mtime_ns, st.st_size))
+        return name, start, end, tuple(out)
+
+    def read(self, name, start=None, end=None):
+        key = self.version(name, start, end)
+        with self._lock:
+            if key in self._merged:
+                self._merged.move_to_end(key)
+                return self._merged[key]
+        days = [day for day, _, _ in key[3]]
+        tables = []
+        for day in days:
+            table = read_table(self._path(name, day))
+            if name == 'popul_guns':
+                table = table.append_column('_day', pa.array(np.full(table.num_rows, day_number(day))))
+            tables.append(table)
+        if not tables:
+            # Nothing in range: the schema of any stored day, without rows
+            tables = [read_table(self._path(name, self.days(name)[0])).slice(0, 0)]
+        table = pa.concat_tables(tables, promote_options='permissive')
+        if name == 'cohorts':
+            dates = pc.cast(table['cohort_date'], pa.string())
+            keep = pc.and_(pc.greater_equal(dates, start or ''), pc.less_equal(dates, end or '9999'))
+            table = table.filter(keep)
+        df = merge(name, table.to_pandas())
+        with self._lock:
+            self._merged[key] = df
+            while len(self._merged) > self.max_entries:
+                self._merged.popitem(last=False)
+        return df
+
+    def write_day(self, day, tables):
+        paths = []
+        for name, df in tables.items():
+            path = self._path(name, day)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if name == 'popul_guns':
+                df = df.assign(players=np.rint(df['users'] * 100 / df['percentage']).astype('int64'))
+            paths.append(write_clean(name, df, path, os.path.join(self.root, QUARANTINE_DIR, day)))
+        return paths
+
+    def first_seen(self):
+        # First active day of every device seen so far, for the cohort cells
+        path = os.path.join(self.root, FIRST_SEEN)
+        if not os.path.exists(path):
+            return pd.Series(dtype='int64', index=pd.Index([], dtype=object, name='device_id'))
+        df = read_table(path).to_pandas()
+        return pd.Series(df['first_day'].to_numpy(), index=pd.Index(df['device_id'], name='device_id'))
+
+    def save_first_seen(self, first_seen):
+        path = os.path.join(self.root, FIRST_SEEN)
+        os.makedirs(self.root, exist_ok=True)
+        df = pd.DataFrame({'device_id': first_seen.index.astype(str), 'first_day': first_seen.to_numpy(np.int64)})
+        feather.write_feather(df, path + '.tmp', compression='uncompressed')
+        os.replace(path + '.tmp', path)
+
+    def memory_usage(self):
+        with self._lock:
+            return {f'{k[0]} {k[1]}..{k[2]}': frame_bytes(df) for k, df in self._merged.items()}
+
+
+def append_events(events_path, devices_path, root=PARTITION_DIR, chunksize=500_000):
+    """Add the days of an events export to the store, one engine per day."""
+    from engine import DEVICE_COLUMNS, MetricsEngine, read_events
+
+    store = PartitionStore(root)
+    last = max((d for name in PARTITIONED for d in store.days(name)), default='')
+    devices = read_csv(devices_path)[DEVICE_COLUMNS]
+    devices['device_id'] = devices['device_id'].astype(str)
+    engines = {}
+    for chunk in read_events(events_path, chunksize):
+        for day, rows in chunk.groupby(chunk['server_date'].astype(str).str[:10], sort=False):
+            if day not in engines:
+                if day <= last:
+                    raise ValueError(f'{day} is not after the last stored day {last}; partitions are append-only')
+                engines[day] = MetricsEngine(devices)
+            engines[day].feed(rows)
+
+    no_day = np.iinfo(np.int64).max
+    first_seen = store.first_seen()
+    paths = []
+    for day in sorted(engines):
+        engine = engines.pop(day)
+        prior = first_seen.reindex(engine.device_index).astype('Int64').fillna(no_day).to_numpy(np.int64)
+        new = (engine.first_day != no_day) & (prior == no_day)
+        # Cohort cells need each device's install day from earlier days
+        engine.first_day = np.minimum(engine.first_day, prior)
+        tables = engine.results()
+        paths += store.write_day(day, {name: tables[name] for name in PARTITIONED})
+        first_seen = pd.concat([first_seen, pd.Series(engine.first_day[new], index=engine.device_index[new])])
+    store.save_first_seen(first_seen)
+    return paths
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(data_dir=DATA_DIR):
+    with _stores_lock:
+        if data_dir not in _stores:
+            _stores[data_dir] = PartitionStore(os.path.join(data_dir, 'partitions'))
+        return _stores[data_dir]
+
+
+def forget(data_dir):
+    with _stores_lock:
+        _stores.pop(data_dir, None)
+
+
+def memory_usage():
+    with _stores_lock:
+        stores = list(_stores.values())
+    return {k: v for store in stores for k, v in store.memory_usage().items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Append the days of a raw events export to the per-day store')
+    parser.add_argument('events')
+    parser.add_argument('devices')
+    parser.add_argument('--root', default=PARTITION_DIR)
+    parser.add_argument('--chunksize', type=int, default=500_000)
+    args = parser.parse_args()
+
+    for path in append_events(args.events, args.devices, args.root, args.chunksize):
+        print(path)
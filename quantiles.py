@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from loader import DATA_DIR, BuiltCache, load
+
+# Log-spaced buckets, so a quantile is reported within ~2% of its true value.
+# Bucket 0 holds zero-length durations, bucket 1 anything up to a second and
+# bucket b > 1 the range (GAMMA^(b-2), GAMMA^(b-1)]
+GAMMA = 1.04
+QUANTILES = {'median': 0.5, 'p90': 0.9}
+
+
+def bucket_of(seconds):
+    seconds = np.asarray(seconds, dtype=np.float64)
+    positive = seconds > 0
+    b = np.ceil(np.log(np.maximum(seconds, 1.0)) / np.log(GAMMA)).astype(np.int64) + 1
+    return np.where(positive, b, 0)
+
+
+def bucket_value(bucket):
+    bucket = np.asarray(bucket, dtype=np.int64)
+    # Midpoint in relative terms of the bucket's range
+    return np.where(bucket > 0, 2 * GAMMA ** (bucket - 1).clip(0) / (GAMMA + 1), 0.0)
+
+
+def histogram(df, keys, value):
+    """Per-cell bucket counts; histograms of disjoint data add up row-wise."""
+    df = df.loc[df[value].notna()]
+    cells = df[keys].assign(bucket=bucket_of(df[value]))
+    return cells.groupby(keys + ['bucket']).size().rename('count').reset_index()
+
+
+class DurationQuantiles:
+    """Quantiles of any country selection and level range from bucket counts.
+
+    ``df`` has one row per (country, level, bucket) with the number of
+    durations that fell into the bucket, as written by the engine.
+    """
+
+    def __init__(self, df, level_col='level'):
+        self.level_col = level_col
+        order = np.lexsort((df['bucket'].to_numpy(), df[level_col].to_numpy()))
+        self.country = np.asarray(df['country'].astype(object).fillna(''), dtype=str)[order]
+        self.level = df[level_col].to_numpy(np.int64)[order]
+        self.bucket = df['bucket'].to_numpy(np.int64)[order]
+        self.count = df['count'].to_numpy(np.int64)[order]
+        for array in (self.country, self.level, self.bucket, self.count):
+            array.setflags(write=False)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.country, self.level, self.bucket, self.count))
+
+    def _select(self, countries, level_min, level_max):
+        lo = np.searchsorted(self.level, level_min, side='left')
+        hi = np.searchsorted(self.level, level_max, side='right')
+        rows = np.arange(lo, hi)
+        if countries is not None and 'all' not in countries:
+            rows = rows[np.isin(self.country[lo:hi], list(countries))]
+        return rows
+
+    def _quantiles(self, keys, rows):
+        # Merge the selected cells' buckets per output row, then walk each
+        # row's cumulative counts up to the requested ranks
+        if not len(rows):
+            index = pd.MultiIndex.from_arrays([[]] * len(keys), names=list(keys))
+            return pd.DataFrame({name: pd.Series(dtype='float64') for name in QUANTILES},
+                                index=index if len(keys) > 1 else index.get_level_values(0))
+        frame = pd.DataFrame({**keys, 'bucket': self.bucket[rows], 'count': self.count[rows]})
+        merged = frame.groupby(list(keys) + ['bucket'])['count'].sum()
+        groups = merged.index.droplevel('bucket')
+        counts = merged.to_numpy()
+        buckets = merged.index.get_level_values('bucket').to_numpy()
+
+        codes, _ = groups.factorize()
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        sizes = np.diff(np.r_[starts, len(counts)])
+        cum = counts.cumsum()
+        within = cum - np.repeat(cum[starts] - counts[starts], sizes)
+        totals = np.add.reduceat(counts, starts)
+        out = {}
+        for name, q in QUANTILES.items():
+            below = within < np.repeat(np.ceil(q * totals), sizes)
+            out[name] = bucket_value(buckets[starts + np.add.reduceat(below, starts)])
+        return pd.DataFrame(out, index=groups[starts])
+
+    def by_level(self, countries, level_min, level_max):
+        rows = self._select(countries, level_min, level_max)
+        return self._quantiles({self.level_col: self.level[rows]}, rows)
+
+    def by_country_level(self, countries, level_min, level_max):
+        rows = self._select(countries, level_min, level_max)
+        return self._quantiles({'country': self.country[rows], self.level_col: self.level[rows]}, rows)
+
+
+_built = BuiltCache()
+
+
+def load_quantiles(name, level_col='level', data_dir=DATA_DIR, days=None):
+    # None when no histogram export exists yet for this data directory
+    try:
+        df = load(name, data_dir, days)
+    except FileNotFoundError:
+        return None
+    return _built.get((data_dir, name, days is not None), df,
+                      lambda df: DurationQuantiles(df, level_col=level_col))
+
+
+def memory_usage():
+    return _built.memory_usage()
+
+
+def forget(data_dir):
+    _built.forget(data_dir)
@@ -0,0 +1,288 @@
+from cohorts import COHORT_DAYS
+from quantiles import GAMMA
+
+# Warehouse queries behind each dataset. app.py shows them under "Show Query
+# Code" and the SQL data sources run them; ClickHouse dialect
+
+RETENTION = '''-- Создание общей таблицы событий с информацией о стране
+WITH events_with_country AS (
+    -- Выборка столбцов device_id, session, server_date из таблицы test.events и столбца country из таблицы test.devices
+    SELECT events.device_id, events.session, events.server_date, devices.country
+    -- Объединение таблиц test.events и test.devices по device_id
+    FROM test.events AS events
+    JOIN test.devices AS devices ON events.device_id = devices.device_id
+),
+-- Создание таблицы с датой первой сессии для каждого устройства
+first_session AS (
+    -- Выборка столбцов device_id, минимальной даты server_date (первой сессии) и country из таблицы events_with_country
+    SELECT device_id, MIN(server_date) AS first_session_date, country
+    FROM events_with_country
+    -- Группировка по device_id и country
+    GROUP BY device_id, country
+),
+-- Создание таблицы удержания пользователей
+retention AS (
+    -- Выборка столбцов device_id, first_session_date, country из таблицы first_session и server_date из таблицы events_with_country,
+    -- а также разницы в днях между first_session_date и server_date как retention_days
+    SELECT 
+        first_session.device_id,
+        first_session.first_session_date,
+        first_session.country,
+        events_with_country.server_date,
+        dateDiff('day', first_session.first_session_date, events_with_country.server_date) AS retention_days
+    FROM 
+        first_session
+        -- Объединение таблиц first_session и events_with_country по device_id
+        JOIN events_with_country ON first_session.device_id = events_with_country.device_id
+),
+-- Создание таблицы с количеством удержанных пользователей для 1-го и 7-го дня удержания
+retention_count AS (
+    -- Выборка столбцов country, retention_days и количества уникальных device_id как retention_count из таблицы retention
+    SELECT country, retention_days, COUNT(DISTINCT device_id) AS retention_count
+    FROM retention
+    -- Фильтрация строк с retention_days равным 1 или 7
+    WHERE retention_days IN (1, 7)
+    -- Группировка по country и retention_days
+    GROUP BY country, retention_days
+),
+-- Создание таблицы с общим количеством пользователей для каждой страны
+total_users AS (
+    -- Выборка столбцов country и количества уникальных device_id как total_users из таблицы first_session
+    SELECT country, COUNT(DISTINCT device_id) AS total_users FROM first_session GROUP BY country
+)
+-- Выборка столбцов country, retention_days из таблицы retention_count,
+-- total_users из таблицы total_users,
+-- retention_count из таблицы retention_count,
+-- а также процента удержания как (retention_count * 100.0) / total_users округленного до 2 знаков после запятой как retention_percent 
+SELECT 
+    retention_count.country,
+    retention_count.retention_days,
+    total_users.total_users,
+    retention_count.retention_count,
+    ROUND((retention_count.retention_count * 100.0) / total_users.total_users, 2) AS retention_percent
+FROM 
+    -- Объединение таблиц retention_count и total_users по country 
+    retention_count
+    JOIN total_users ON retention_count.country = total_users.country;'''
+
+LOSERATE = '''-- Создание таблицы с количеством игроков, начавших каждый уровень в каждой стране
+WITH level_started AS (
+    -- Выборка столбцов country из таблицы test.devices, level из таблицы test.events и количества уникальных device_id как players
+    SELECT
+        devices.country,
+        events.level,
+        COUNT(DISTINCT events.device_id) AS players
+    -- Объединение таблиц test.events и test.devices по device_id
+    FROM test.events AS events
+    JOIN test.devices AS devices ON events.device_id = devices.device_id
+    -- Фильтрация строк с event равным 'level_started'
+    WHERE events.event = 'level_started'
+    -- Группировка по country и level
+    GROUP BY devices.country, events.level
+),
+-- Создание таблицы с количеством игроков, завершивших каждый уровень в каждой стране
+level_completed AS (
+    -- Выборка столбцов country из таблицы test.devices, level из таблицы test.events и количества уникальных device_id как players
+    SELECT
+        devices.country,
+        events.level,
+        COUNT(DISTINCT events.device_id) AS players
+    -- Объединение таблиц test.events и test.devices по device_id
+    FROM test.events AS events
+    JOIN test.devices AS devices ON events.device_id = devices.device_id
+    -- Фильтрация строк с event равным 'level_completed'
+    WHERE events.event = 'level_completed'
+    -- Группировка по country и level
+    GROUP BY devices.country, events.level
+)
+-- Выборка столбцов country, level из таблицы level_started,
+-- players из таблицы level_started как players_started,
+-- players из таблицы level_completed как players_completed,
+-- а также процента оттока как (players_started - players_completed) / players_started * 100 как churn_rate 
+SELECT
+    level_started.country,
+    level_started.level,
+    level_started.players AS players_started,
+    level_completed.players AS players_completed,
+    (level_started.players - level_completed.players) / level_started.players * 100 AS churn_rate
+-- Объединение таблиц level_started и level_completed по country и level 
+FROM level_started
+JOIN level_completed ON level_started.country = level_completed.country AND level_started.level = level_completed.level
+-- Сортировка по country и level 
+ORDER BY level_started.country, level_started.level;'''
+
+LOSE_USERS = '''-- Объявление общего табличного выражения для подсчета количества игроков, которые начали уровень
+WITH
+    level_started AS (
+        SELECT
+            devices.country, -- Выбор страны
+            events.level, -- Выбор уровня
+            COUNT(DISTINCT events.device_id) AS players_started -- Подсчет количества уникальных игроков, которые начали уровень
+        FROM test.events AS events -- Использование таблицы событий
+        JOIN test.devices AS devices ON events.device_id = devices.device_id -- Присоединение таблицы устройств по идентификатору устройства
+        WHERE events.event = 'level_started' -- Фильтрация событий, чтобы выбрать только те, которые соответствуют началу уровня
+        GROUP BY devices.country, events.level -- Группировка по стране и уровню
+    ),
+    -- Объявление общего табличного выражения для подсчета количества игроков, которые завершили уровень
+    level_completed AS (
+        SELECT
+            devices.country, -- Выбор страны
+            events.level, -- Выбор уровня
+            COUNT(DISTINCT events.device_id) AS players_completed -- Подсчет количества уникальных игроков, которые завершили уровень
+        FROM test.events AS events -- Использование таблицы событий
+        JOIN test.devices AS devices ON events.device_id = devices.device_id -- Присоединение таблицы устройств по идентификатору устройства
+        WHERE events.event = 'level_completed' -- Фильтрация событий, чтобы выбрать только те, которые соответствуют завершению уровня
+        GROUP BY devices.country, events.level -- Группировка по стране и уровню
+    )
+-- Выбор данных из общих табличных выражений и вычисление разницы между количеством игроков, которые начали и завершили уровень
+SELECT
+    level_started.country, -- Выбор страны из первого общего табличного выражения
+    level_started.level, -- Выбор уровня из первого общего табличного выражения
+    level_started.players_started, -- Выбор количества игроков, которые начали уровень из первого общего табличного выражения
+    (level_started.players_started - level_completed.players_completed) AS players_churned -- Вычисление разницы между количеством игроков, которые начали и завершили уровень (отток игроков)
+FROM level_started -- Использование первого общего табличного выражения в качестве основной таблицы для выборки данных
+JOIN level_completed ON level_started.country = level_completed.country AND level_started.level = level_completed.level -- Присоединение второго общего табличного выражения по стране и уровню для получения соответствующих данных о завершении уровня
+ORDER BY level_started.country, level_started.level; -- Упорядочивание результата по стране и уровню.'''
+
+AVG_DUR_LEV = '''-- Выбираем поля страны, уровня и средней продолжительности
+SELECT
+    devices.country,
+    events.level,
+    AVG(events.param1) AS avg_duration,
+    -- Сумма и количество, чтобы средние по нескольким странам и уровням считались точно
+    SUM(events.param1) AS duration_sum,
+    COUNT(events.param1) AS duration_count
+-- Из таблицы событий
+FROM test.events AS events
+-- Соединяем с таблицей устройств по device_id
+JOIN test.devices AS devices ON events.device_id = devices.device_id
+-- Фильтруем только события завершения уровня
+WHERE events.event = 'level_completed'
+-- Группируем по стране и уровню
+GROUP BY devices.country, events.level
+-- Сортируем по стране и уровню
+ORDER BY devices.country, events.level;'''
+
+_SESSION_RANKS = '''WITH
+    session_durations AS (
+        SELECT
+            device_id,
+            session,
+            MAX(server_time) - MIN(server_time) AS session_duration
+        FROM test.events
+        GROUP BY device_id, session
+    ),
+    session_ranks AS (
+        SELECT
+            device_id,
+            session,
+            session_duration,
+            rank() OVER (PARTITION BY device_id ORDER BY MIN(server_time)) AS session_rank
+        FROM test.events
+        JOIN session_durations USING (device_id, session)
+        GROUP BY device_id, session, session_duration
+    )
+'''
+
+AVG_DUR_SESS = _SESSION_RANKS + '''SELECT
+    country,
+    session_rank,
+    AVG(session_duration) AS avg_session_duration,
+    SUM(session_duration) AS duration_sum,
+    COUNT(session_duration) AS duration_count
+FROM test.devices
+JOIN session_ranks USING (device_id)
+GROUP BY country, session_rank;'''
+
+POPUL_GUNS = '''-- Создаем подзапрос gun_stats, который вычисляет количество пользователей, выбирающих каждый пистолет на каждом уровне в каждой стране
+WITH gun_stats AS (
+    SELECT
+        country, -- Выбираем страну
+        JSONExtractInt(extra, 'level_tnt') AS level, -- Извлекаем уровень из поля extra
+        JSONExtractString(extra, 'gun_name') AS gun_name, -- Извлекаем имя пистолета из поля extra
+        COUNT(DISTINCT device_id) AS users -- Считаем количество уникальных пользователей
+    FROM test.events -- Используем таблицу test.events
+    JOIN test.devices USING (device_id) -- Присоединяем таблицу test.devices по полю device_id
+    WHERE event = 'level_started' -- Отбираем только события начала уровня
+    GROUP BY country, level, gun_name -- Группируем результаты по стране, уровню и имени пистолета
+),
+-- Создаем подзапрос total_stats, который вычисляет общее количество пользователей на каждом уровне в каждой стране
+total_stats AS (
+    SELECT
+        country, -- Выбираем страну
+        JSONExtractInt(extra, 'level_tnt') AS level, -- Извлекаем уровень из поля extra
+        COUNT(DISTINCT device_id) AS total_users -- Считаем общее количество уникальных пользователей
+    FROM test.events -- Используем таблицу test.events
+    JOIN test.devices USING (device_id) -- Присоединяем таблицу test.devices по полю device_id
+    WHERE event = 'level_started' -- Отбираем только события начала уровня
+    GROUP BY country, level -- Группируем результаты по стране и уровню
+)
+-- Выбираем результаты из подзапросов gun_stats и total_stats и вычисляем процент пользователей, выбирающих каждый пистолет на каждом уровне в каждой стране
+SELECT
+    gun_stats.country, -- Выбираем страну из подзапроса gun_stats
+    gun_stats.level, -- Выбираем уровень из подзапроса gun_stats
+    gun_stats.gun_name, -- Выбираем имя пистолета из подзапроса gun_stats
+    gun_stats.users, -- Выбираем количество пользователей из подзапроса gun_stats
+    gun_stats.users / total_stats.total_users * 100 AS percentage -- Вычисляем процент пользователей, выбирающих данный пистолет на данном уровне в данной стране
+FROM gun_stats -- Используем результаты подзапроса gun_stats
+JOIN total_stats USING (country, level) -- Присоединяем результаты подзапроса total_stats по полям country и level
+ORDER BY country, level, percentage DESC; -- Сортируем результаты по стране, уровню и проценту в порядке убывания процента.'''
+
+
+def _bucket(value):
+    # quantiles.bucket_of in SQL; the base of log() cancels out
+    return (f'CASE WHEN {value} > 0 THEN CAST(ceil(log(greatest({value}, 1)) / log({GAMMA})) AS Int64) + 1 '
+            'ELSE 0 END')
+
+
+DUR_HIST_LEV = f'''SELECT
+    devices.country,
+    events.level,
+    {_bucket('events.param1')} AS bucket,
+    COUNT(*) AS count
+FROM test.events AS events
+JOIN test.devices AS devices ON events.device_id = devices.device_id
+WHERE events.event = 'level_completed' AND events.param1 IS NOT NULL
+GROUP BY devices.country, events.level, bucket;'''
+
+DUR_HIST_SESS = _SESSION_RANKS + f'''SELECT
+    country,
+    session_rank,
+    {_bucket('session_duration')} AS bucket,
+    COUNT(*) AS count
+FROM test.devices
+JOIN session_ranks USING (device_id)
+GROUP BY country, session_rank, bucket;'''
+
+COHORTS = f'''-- Когорты по дате первой сессии: сколько устройств было активно через 0..{COHORT_DAYS} дней после нее
+WITH events_with_country AS (
+    SELECT events.device_id, events.server_date, devices.country
+    FROM test.events AS events
+    JOIN test.devices AS devices ON events.device_id = devices.device_id
+),
+first_session AS (
+    SELECT device_id, MIN(server_date) AS first_session_date, country
+    FROM events_with_country
+    GROUP BY device_id, country
+)
+SELECT
+    first_session.country,
+    first_session.first_session_date AS cohort_date,
+    dateDiff('day', first_session.first_session_date, events_with_country.server_date) AS day,
+    COUNT(DISTINCT first_session.device_id) AS users
+FROM first_session
+JOIN events_with_country ON first_session.device_id = events_with_country.device_id
+WHERE dateDiff('day', first_session.first_session_date, events_with_country.server_date) BETWEEN 0 AND {COHORT_DAYS}
+GROUP BY first_session.country, cohort_date, day;'''
+
+QUERIES = {
+    'retention': RETENTION,
+    'loserate': LOSERATE,
+    'lose_users': LOSE_USERS,
+    'avg_dur_lev': AVG_DUR_LEV,
+    'avg_dur_sess': AVG_DUR_SESS,
+    'popul_guns': POPUL_GUNS,
+    'dur_hist_lev': DUR_HIST_LEV,
+    'dur_hist_sess': DUR_HIST_SESS,
+    'cohorts': COHORTS,
+}
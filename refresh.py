@@ -0,0 +1,268 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+
+from loader import DATA_DIR, DATASETS, SNAPSHOT_EXT, SOURCE, export_version, read_any, uses_source, version
+from ingest import QUARANTINE_DIR, write_clean
+from sketch import SKETCH_NAME
+
+SNAPSHOT_DIR = os.path.join(DATA_DIR, 'snapshots')
+CURRENT = 'CURRENT'
+MANIFEST = 'manifest.json'
+# Seconds between checks of the source; 0 leaves the worker off, and a
+# snapshot built with ``python refresh.py`` is then picked up on restart
+REFRESH_SECONDS = float(os.environ.get('DASHBOARD_REFRESH_SECONDS', 300))
+# An export modified more recently than this may still be being copied in
+SETTLE_SECONDS = 5
+# Snapshots kept on disk: the current one and the one in-flight reruns may
+# still be reading
+KEEP = 2
+# Read-only files that are linked into every snapshot rather than copied
+SHARED = ('partitions', SKETCH_NAME)
+
+Snapshot = namedtuple('Snapshot', ['version', 'path', 'created', 'sources'])
+
+
+def _files(path):
+    if os.path.isfile(path):
+        yield path
+    for root, _, files in os.walk(path):
+        for f in files:
+            if not f.endswith('.tmp'):
+                yield os.path.join(root, f)
+
+
+def source_versions(data_dir=DATA_DIR):
+    out = {}
+    for name in DATASETS:
+        try:
+            out[name] = version(name, data_dir)
+        except FileNotFoundError:
+            continue
+    if not out:
+        return '{}'
+    # Appended partition days and rebuilt sketches need a new snapshot too
+    for shared in SHARED:
+        root = os.path.join(data_dir, shared)
+        out[shared] = sorted((os.path.relpath(p, root), os.stat(p).st_mtime_ns) for p in _files(root))
+    return json.dumps(out, sort_keys=True, default=str)
+
+
+def _fetch(name, data_dir):
+    if uses_source(data_dir):
+        from sources import get_source
+        return get_source(SOURCE).fetch(name)
+    return read_any(export_version(name, data_dir)[0])
+
+
+def _settled(data_dir):
+    # Exports still being written have a fresh mtime
+    if uses_source(data_dir):
+        return True
+    now = time.time_ns()
+    for name in DATASETS:
+        try:
+            _, mtime, _ = export_version(name, data_dir)
+        except FileNotFoundError:
+            continue
+        if now - mtime < SETTLE_SECONDS * 1e9:
+            return False
+    return True
+
+
+def _link(src, dst):
+    for path in _files(src):
+        target = os.path.join(dst, os.path.relpath(path, src)) if os.path.isdir(src) else dst
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
+
+
+def _read_snapshot_dir(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    return Snapshot(manifest['version'], path, manifest['created'], manifest['sources'])
+
+
+def _forget(data_dir):
+    import cohorts
+    import cube
+    import guns
+    import loader
+    import partitions
+    import quantiles
+    for module in (loader, cube, quantiles, guns, cohorts, partitions):
+        module.forget(data_dir)
+
+
+def _warm(path):
+    # Everything a section reads, loaded before any viewer sees the snapshot
+    from cohorts import load_cohorts
+    from report import load_context
+    load_context(path)
+    load_cohorts(path)
+
+
+class Refresher:
+    """Builds versioned snapshots of the datasets and swaps them in.
+
+    A snapshot is a complete directory of Arrow files, written under a
+    temporary name and renamed into place, then loaded and swapped in with
+    a single reference assignment. Reruns read ``current()`` once at their
+    start, so a swap never changes the data under a rerun in progress.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, root=SNAPSHOT_DIR, interval=REFRESH_SECONDS, keep=KEEP, warm=_warm):
+        self.data_dir = data_dir
+        self.root = root
+        self.interval = interval
+        self.keep = keep
+        self.warm = warm
+        self.error = None
+        self.checked = None
+        self._current = self._on_disk()
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._thread = None
+
+    def _on_disk(self):
+        try:
+            with open(os.path.join(self.root, CURRENT)) as f:
+                return _read_snapshot_dir(os.path.join(self.root, f.read().strip()))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def current(self):
+        return self._current
+
+    def refresh(self):
+        """Swaps in a new snapshot if the source changed; True if it did."""
+        with self._build_lock:
+            self.checked = time.time()
+            # Another process may have built one already
+            latest = self._on_disk()
+            current = self._current
+            if latest is not None and (current is None or latest.version > current.version):
+                self.warm(latest.path)
+                self._swap(latest)
+                current = latest
+
+            sources = source_versions(self.data_dir)
+            if sources == '{}' or (current is not None and current.sources == sources):
+                return False
+            if not _settled(self.data_dir):
+                return False
+            snap = self._build(sources)
+            if snap is None:
+                return False
+            self.warm(snap.path)
+            self._swap(snap)
+            return True
+
+    def _build(self, sources):
+        created = time.time()
+        name = time.strftime('%Y%m%dT%H%M%S', time.localtime(created)) + '-' + \
+            hashlib.sha1(sources.encode()).hexdigest()[:8]
+        path = os.path.join(self.root, name)
+        tmp = os.path.join(self.root, f'.{name}.{os.getpid()}.tmp')
+        os.makedirs(tmp)
+        try:
+            listed = json.loads(sources)
+            for dataset in (name for name in DATASETS if name in listed):
+                try:
+                    df = _fetch(dataset, self.data_dir)
+                except FileNotFoundError:
+                    continue
+                write_clean(dataset, df, os.path.join(tmp, dataset + SNAPSHOT_EXT), os.path.join(tmp, QUARANTINE_DIR),
+                            listed[dataset])
+            if source_versions(self.data_dir) != sources:
+                # Changed while being read; the next round takes it
+                shutil.rmtree(tmp)
+                return None
+            for shared in SHARED:
+                if os.path.exists(os.path.join(self.data_dir, shared)):
+                    _link(os.path.join(self.data_dir, shared), os.path.join(tmp, shared))
+            with open(os.path.join(tmp, MANIFEST), 'w') as f:
+                json.dump({'version': name, 'created': created, 'sources': sources}, f)
+            os.rename(tmp, path)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return Snapshot(name, path, created, sources)
+
+    def _swap(self, snap):
+        with self._lock:
+            previous, self._current = self._current, snap
+        pointer = os.path.join(self.root, CURRENT)
+        with open(pointer + '.tmp', 'w') as f:
+            f.write(snap.version)
+        os.replace(pointer + '.tmp', pointer)
+        if previous is None:
+            # Reruns from before the first snapshot read the exports directly
+            _forget(self.data_dir)
+        self._retire()
+
+    def _retire(self):
+        names = sorted(n for n in os.listdir(self.root) if not n.startswith('.') and not n.startswith(CURRENT))
+        current = self._current.version
+        for name in [n for n in names if n != current][:max(0, len(names) - self.keep)]:
+            path = os.path.join(self.root, name)
+            _forget(path)
+            shutil.rmtree(path, ignore_errors=True)
+
+    def status(self):
+        snap = self._current
+        return {
+            'version': None if snap is None else snap.version,
+            'age': None if snap is None else time.time() - snap.created,
+            'checked': None if self.checked is None else time.time() - self.checked,
+            'error': self.error,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='dashboard-refresh', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+                self.error = None
+            except Exception as e:
+                # Viewers keep the current snapshot; the error shows in the UI
+                self.error = f'{type(e).__name__}: {e}'
+            time.sleep(self.interval)
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def get_refresher():
+    # One worker per app process, started by the first rerun
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = Refresher()
+            if REFRESH_SECONDS > 0:
+                _refresher.start()
+        return _refresher
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a dataset snapshot now if the source has changed')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    args = parser.parse_args()
+
+    refresher = Refresher(args.data_dir, os.path.join(args.data_dir, 'snapshots'), warm=lambda path: None)
+    os.makedirs(refresher.root, exist_ok=True)
+    print(refresher.current().path if refresher.refresh() else 'up to date')
@@ -0,0 +1,147 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cube import load_cube
+from guns import load_guns
+from loader import DATA_DIR, load
+from quantiles import load_quantiles
+from sections import (COUNTRIES, DEFAULT_COUNTRIES, DURATION_VALUES, TOP_OPTIONS, churn_fig,
+                      churn_frame, duration_table, duration_totals, gun_table, loserate_fig, loserate_frame,
+                      retention_by_country, retention_gauges, retention_totals)
+
+REPORT_DIR = 'reports'
+FORMATS = ('html', 'png', 'csv')
+
+# Loaded once in the parent; forked workers inherit it without copying
+_context = None
+
+
+def load_context(data_dir=DATA_DIR):
+    # Section inputs, built the same way app.py builds them
+    def optional(fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except FileNotFoundError:
+            return None
+
+    return {
+        'retention': optional(load, 'retention', data_dir),
+        'loserate': optional(load_cube, 'loserate', ['players_started', 'players_completed'], data_dir=data_dir),
+        'churn': optional(load_cube, 'lose_users', ['players_started', 'players_churned'], data_dir=data_dir),
+        'level_duration': optional(load_cube, 'avg_dur_lev', DURATION_VALUES, prepare=duration_totals,
+                                   data_dir=data_dir),
+        'level_quantiles': load_quantiles('dur_hist_lev', data_dir=data_dir),
+        'session_duration': optional(load_cube, 'avg_dur_sess', DURATION_VALUES, level_col='session_rank',
+                                     prepare=duration_totals, data_dir=data_dir),
+        'session_quantiles': load_quantiles('dur_hist_sess', level_col='session_rank', data_dir=data_dir),
+        'guns': optional(load_guns, data_dir=data_dir),
+    }
+
+
+def render(ctx, country, level_min, level_max, top):
+    """(title, figure or table) pairs of one country's report, in dashboard order."""
+    countries = [country]
+    parts = []
+    df_r = ctx['retention']
+    if df_r is not None:
+        own = df_r if country == 'all' else df_r.loc[df_r['country'] == country]
+        if len(own):
+            parts.append(('Retention of the 1 and 7 days', retention_gauges(retention_totals(own))))
+            fig_1, fig_2 = retention_by_country(df_r, DEFAULT_COUNTRIES if country == 'all' else countries)
+            parts += [('One day retention', fig_1), ('Seven day retention', fig_2)]
+    if ctx['loserate'] is not None:
+        parts.append(('Loserate by levels', loserate_fig(loserate_frame(ctx['loserate'], countries, level_min,
+                                                                        level_max))))
+    if ctx['churn'] is not None:
+        parts.append(('The number of players who left by level',
+                      churn_fig(churn_frame(ctx['churn'], countries, level_min, level_max))))
+    if ctx['level_duration'] is not None:
+        parts.append(('Average level duration', duration_table(ctx['level_duration'], countries, level_min,
+                                                               level_max, ctx['level_quantiles'])))
+    if ctx['session_duration'] is not None:
+        parts.append(('Average session duration', duration_table(ctx['session_duration'], countries, level_min,
+                                                                 level_max, ctx['session_quantiles'])))
+    if ctx['guns'] is not None:
+        parts.append(('Popularity of guns', gun_table(ctx['guns'], countries, level_min, level_max, top)))
+    return parts
+
+
+def _slug(title):
+    return title.lower().replace(' ', '_')
+
+
+def write_report(parts, out_dir, country, formats):
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    html = [f'<html><head><meta charset="utf-8"><title>{country}</title></head><body>',
+            f'<h1>Helicopter Escape 3d Analytics: {country}</h1>']
+    plotly_js = 'cdn'
+    for title, part in parts:
+        is_table = hasattr(part, 'columns')
+        html.append(f'<h2>{title}</h2>')
+        if is_table:
+            html.append(part.to_html())
+            if 'csv' in formats:
+                paths.append(os.path.join(out_dir, _slug(title) + '.csv'))
+                part.to_csv(paths[-1])
+        else:
+            # plotly.js is embedded by reference once per page
+            html.append(part.to_html(full_html=False, include_plotlyjs=plotly_js))
+            plotly_js = False
+            if 'png' in formats:
+                paths.append(os.path.join(out_dir, _slug(title) + '.png'))
+                part.write_image(paths[-1])
+    if 'html' in formats:
+        paths.append(os.path.join(out_dir, 'report.html'))
+        with open(paths[-1], 'w') as f:
+            f.write('\n'.join(html + ['</body></html>']))
+    return paths
+
+
+def _export(task):
+    country, out_dir, formats, level_min, level_max, top = task
+    parts = render(_context, country, level_min, level_max, top)
+    return write_report(parts, os.path.join(out_dir, country), country, formats)
+
+
+def export(countries, out_dir=REPORT_DIR, formats=('html', 'csv'), level_min=1, level_max=10, top='Top-1',
+           workers=None, data_dir=DATA_DIR):
+    global _context
+    if 'png' in formats:
+        try:
+            import kaleido  # noqa: F401
+        except ImportError:
+            raise SystemExit('PNG export needs the kaleido package (pip install kaleido)')
+    _context = load_context(data_dir)
+    tasks = [(c, out_dir, formats, level_min, level_max, top) for c in countries]
+    workers = workers or os.cpu_count() or 1
+    # Forked workers share the loaded context copy-on-write; without fork
+    # each worker would need its own copy, so the export stays in-process
+    if workers == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        return [path for task in tasks for path in _export(task)]
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+        done = pool.map(_export, tasks, chunksize=max(1, len(tasks) // (workers * 4)))
+        return [path for paths in done for path in paths]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Render per-country dashboard reports without a Streamlit server')
+    parser.add_argument('--countries', nargs='+', default=COUNTRIES,
+                        help="country codes, 'all' for the totals; defaults to every country")
+    parser.add_argument('--out', default=REPORT_DIR)
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=['html', 'csv'],
+                        help='png needs the kaleido package')
+    parser.add_argument('--level-min', type=int, default=1)
+    parser.add_argument('--level-max', type=int, default=10)
+    parser.add_argument('--top', choices=list(TOP_OPTIONS), default='Top-1')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    paths = export(args.countries, args.out, args.formats, args.level_min, args.level_max, args.top,
+                   args.workers, args.data_dir)
+    print(f'{len(paths)} files for {len(args.countries)} countries in {time.perf_counter() - start:.1f}s')
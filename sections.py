@@ -0,0 +1,250 @@
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from quantiles import QUANTILES
+
+# Section logic of the dashboard, free of Streamlit calls so that it can be
+# reused by the benchmark harness and headless exports
+
+COUNTRIES = [
+    'IN', 'US', 'RU', 'MX', 'BR', 'LR', 'IS', 'LA', 'SO', 'VN', 'BJ', 'FJ', 'KY', 'DZ', 'TW', 'TM', 'EH', 'TD', 'MZ', 'BY',
+    'GB', 'VG', 'HR', 'IT', 'CV', 'RS', 'LU', 'HU', 'BW', 'MT', 'SR', 'XX', 'VI', 'GL', 'MN', 'BD', 'SA', 'MG', 'GE', 'TC',
+    'JE', 'OM', 'TJ', 'NE', 'ZA', 'AF', 'NL', 'AO', 'PY', 'KW', 'AU', 'AR', 'BM', 'XK', 'FM', 'CL', 'MS', 'KM', 'PM', 'WF',
+    'AI', 'PL', 'PW', 'NC', 'PE', 'AS', 'NP', 'AZ', 'JP', 'ES', 'TL', 'GY', 'GP', 'MR', 'ST', 'VU', 'SG', 'YE', 'MA', 'BB',
+    'MH', 'SN', 'RO', 'FK', 'CY', 'CM', 'CD', 'CW', 'WS', 'LT', 'HT', 'SS', 'GW', 'MU', 'SZ', 'HN', 'BL', 'SI', 'MO', 'GM',
+    'BE', 'GD', 'ET', 'EG', 'JM', 'AG', 'KE', 'DO', 'PK', 'UY', 'AT', 'TV', 'IR', 'LS', 'LI', 'MF', 'IM', 'CO', 'CF', 'ID',
+    'LV', 'GU', 'MW', 'BT', 'SX', 'SK', 'MM', 'BN', 'GF', 'MD', 'SB', 'BG', 'VC', 'TZ', 'EE', 'QA', 'JO', 'UA', 'AE', 'KG',
+    'KN', 'AL', 'NO', 'DM', 'PS', 'DJ', 'KI', 'PG', 'PT', 'KZ', 'TT', 'TN', 'TG', 'BZ', 'MY', 'SE', 'GA', 'BS', 'GR', 'MP',
+    'SV', 'YT', 'HK', 'BI', 'GH', 'SL', 'CA', 'LB', 'CH', 'LK', 'FI', 'CR', 'RW', 'NF', 'AX', 'MC', 'AW', 'PR', 'UZ', 'AD',
+    'NG', 'DE', 'PA', 'AM', 'PH', 'TH', 'TR', 'SC', 'ME', 'GG', 'BF', 'GN', 'ML', 'BO', 'SY', 'MV', 'GT', 'IE', 'CG', 'FO',
+    'CN', 'IL', 'IQ', 'FR', 'CZ', 'LY', 'CI', 'RE', 'LC', 'BH', 'GI', 'MK', 'BA', 'VE', 'SD', 'MQ', 'EC', 'NZ', 'ZW', 'KR',
+    'PF', 'UG', 'DK', 'NI', 'ZM', 'KH', 'SM',
+]
+
+DEFAULT_COUNTRIES = ['IN', 'US', 'RU', 'MX', 'BR']
+TOP_OPTIONS = {'Top-1': 1, 'Top-3': 3, 'Top-5': 5, 'Top-10': 10}
+DURATION_VALUES = ['duration_sum', 'duration_count']
+# Level charts draw one bar per level up to BAR_LEVELS levels; wider ranges
+# become WebGL lines with at most MAX_LEVEL_POINTS points, consecutive levels
+# summed into one point, so the figure stays the same size however many
+# levels the game has
+BAR_LEVELS = 60
+MAX_LEVEL_POINTS = 400
+
+
+def clean_selection(options):
+    options = list(options)
+    if len(options) > 1 and 'all' in options:
+        options.remove('all')
+    return options
+
+
+def retention_totals(df_r):
+    df_r_all = df_r.groupby(by=['retention_days'])[['total_users', 'retention_count']].sum()
+    df_r_all['retention_percent'] = df_r_all['retention_count'] / df_r_all['total_users'] * 100
+    return df_r_all
+
+
+def _gauge(value, title):
+    return go.Indicator(
+        mode = "gauge+number+delta",
+        value = value,
+        domain = {'x': [0, 1], 'y': [0, 1]},
+        gauge = {
+            'axis': {'range': [None, 100]},
+            'bar': {'color': "lightgreen"}
+        },
+        number = {'suffix': "%"},
+        title = {'text': title}
+    )
+
+
+def retention_gauges(df_r_all):
+    fig = make_subplots(rows=1, cols=2, specs=[[{'type': 'indicator'}, {'type': 'indicator'}]])
+    # A day with no retained users has no row at all
+    percent = df_r_all['retention_percent']
+    fig.add_trace(_gauge(percent.get(1, 0.0), "One day retention"), row=1, col=1)
+    fig.add_trace(_gauge(percent.get(7, 0.0), "Seven day retention"), row=1, col=2)
+    return fig
+
+
+def make_fig(df, countries=DEFAULT_COUNTRIES, name=''):
+    df = df[df['country'].isin(countries)]
+    df = df.sort_values('retention_percent', ascending=False)
+
+    colors = ['lightgreen']
+    fig = px.bar(df, x='country', y='retention_percent', color_discrete_sequence=colors)
+    fig.update_layout(
+        title=name,
+        xaxis_title='Country',
+        yaxis_title='Retention Percent',
+        yaxis=dict(range=[0, 100])
+    )
+    return fig
+
+
+def retention_by_country(df_r, countries):
+    # Only the selected countries' rows are taken out of the shared frame
+    selected = df_r['country'].isin(countries)
+    df_r_1 = df_r.loc[selected & (df_r['retention_days'] == 1)]
+    df_r_7 = df_r.loc[selected & (df_r['retention_days'] == 7)]
+    return (make_fig(df_r_1, countries=countries, name='One day retention'),
+            make_fig(df_r_7, countries=countries, name='Seven Day retention'))
+
+
+def cohort_day_fig(cohorts, countries, day):
+    return make_fig(cohorts.day_n(day), countries=countries, name=f'Day {day} retention')
+
+
+def cohort_heatmap(matrix):
+    # Day 0 is always 100%, so the colour scale follows the later days
+    later = matrix.iloc[:, 1:].to_numpy()
+    top = np.nanmax(later) if np.isfinite(later).any() else 100
+    fig = px.imshow(matrix, x=matrix.columns, y=matrix.index.strftime('%Y-%m-%d'), zmin=0, zmax=top,
+                    color_continuous_scale='Greens', aspect='auto',
+                    labels=dict(x='Days since the first session', y='Install cohort', color='Retention Percent'))
+    return fig
+
+
+def loserate_frame(cube, countries, level_min, level_max, max_points=MAX_LEVEL_POINTS):
+    df_l_all = cube.binned(countries, level_min, level_max, max_points)
+    df_l_all['churn_rate'] = 100-(df_l_all['players_completed'] / df_l_all['players_started'] * 100)
+    return df_l_all
+
+
+def level_note(cube, level_min, level_max):
+    # Zoom events don't reach the server; the level inputs are the zoom
+    n = cube.count_levels(level_min, level_max)
+    if n <= MAX_LEVEL_POINTS:
+        return None
+    return (f'{n:,} levels drawn as {MAX_LEVEL_POINTS} points of about {n / MAX_LEVEL_POINTS:.0f} levels each; '
+            f'narrow the level range to {MAX_LEVEL_POINTS} levels or fewer to see every level.')
+
+
+def _wide(df):
+    return len(df.index) > BAR_LEVELS
+
+
+def _level_lines(df, columns, names, colors, fmt):
+    # Points sit at their rank, so outlier ids don't stretch the axis; ticks
+    # show the first level of the run and the hover its whole span
+    x = np.arange(len(df.index))
+    first, last = df.index.to_numpy().astype(str), df['last_level'].to_numpy().astype(str)
+    spans = np.where(first == last, first, np.char.add(np.char.add(first, '–'), last))
+    fig = go.Figure()
+    for column, name, color in zip(columns, names, colors):
+        fig.add_trace(go.Scattergl(x=x, y=df[column], name=name, mode='lines', line_color=color,
+                                   customdata=spans, hovertemplate=f'Level %{{customdata}}<br>{name} %{{y:{fmt}}}'))
+    ticks = x[::max(1, len(x) // 10)]
+    fig.update_xaxes(tickvals=ticks, ticktext=first[ticks])
+    return fig
+
+
+def loserate_fig(df_l_all):
+    if _wide(df_l_all):
+        fig = _level_lines(df_l_all, ['churn_rate'], ['Lose Rate'], ['lightcoral'], '.1f')
+        fig.update_traces(fill='tozeroy')
+        fig.update_layout(title='Loserate by Level', xaxis_title='Level', yaxis_title='Loserate (%)',
+                          yaxis=dict(range=[0, 100]), width=800, height=600)
+        return fig
+
+    N = len(df_l_all.index)
+    ind = np.arange(N)
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=ind, y=df_l_all['churn_rate'], name='Lose Rate', marker_color='lightcoral'))
+    fig.add_trace(go.Bar(x=ind, y=100 - df_l_all['churn_rate'], name='Retention Rate', marker_color='lightgreen'))
+
+    fig.update_layout(
+    title='Loserate by Level',
+    xaxis_title='Level',
+    yaxis_title='Loserate (%)',
+    barmode='stack',
+    width=800,
+    height=600
+    )
+
+    fig.update_xaxes(tickvals=ind, ticktext=df_l_all.index)
+    return fig
+
+
+def churn_frame(cube, countries, level_min, level_max, max_points=MAX_LEVEL_POINTS):
+    return cube.binned(countries, level_min, level_max, max_points)
+
+
+def churn_fig(df_lu_all):
+    if _wide(df_lu_all):
+        fig = _level_lines(df_lu_all, ['players_started', 'players_churned'], ['players_started', 'players_churned'],
+                           ['lightgreen', 'lightcoral'], ',.0f')
+        fig.update_layout(xaxis_title='Level', yaxis_title='Players', width=800, height=600)
+        return fig
+
+    fig = px.bar(df_lu_all.reset_index(), x=['players_started', 'players_churned'], y='level', orientation='h', color_discrete_sequence=['lightgreen', 'lightcoral'])
+    fig.update_layout(yaxis=dict(autorange="reversed"), width=800,
+    height=600)
+    return fig
+
+
+def convert_time(seconds):
+    m, s = divmod(seconds, 60)
+    h, m = divmod(m, 60)
+    return f'{int(h):02d}:{int(m):02d}:{int(s):02d}'
+
+
+def format_durations(seconds):
+    """convert_time() over a whole array at once; NaN stays missing."""
+    seconds = np.asarray(seconds, dtype=np.float64)
+    missing = np.isnan(seconds)
+    h, rest = np.divmod(np.floor(np.where(missing, 0, seconds)).astype(np.int64), 3600)
+    m, s = np.divmod(rest, 60)
+    # HH:MM:SS written straight into eight ASCII bytes per value
+    chars = np.full((len(seconds), 8), ord(':'), dtype=np.uint8)
+    for col, part in ((0, h), (3, m), (6, s)):
+        chars[:, col] = part // 10 % 10 + ord('0')
+        chars[:, col + 1] = part % 10 + ord('0')
+    out = chars.view('S8').ravel().astype('U8').astype(object)
+    # A negative time or one of 100 hours or more doesn't fit the eight bytes
+    odd = ~missing & ((h < 0) | (h > 99))
+    out[odd] = [convert_time(x) for x in seconds[odd]]
+    out[missing] = np.nan
+    return out
+
+
+def format_table(df):
+    # The *_time columns of duration_seconds() as HH:MM:SS
+    return df.assign(**{c: format_durations(df[c]) for c in df.columns if c.endswith('_time')})
+
+
+def duration_totals(df):
+    # Exports from before sum/count were carried only have the cell means;
+    # those are weighted one each, which is the best they allow
+    if 'duration_sum' in df.columns:
+        return df
+    avg = 'avg_duration' if 'avg_duration' in df.columns else 'avg_session_duration'
+    return df.assign(duration_sum=df[avg], duration_count=1)
+
+
+def duration_seconds(cube, countries, level_min, level_max, quantiles=None):
+    """duration_table() with the times left as seconds, for sorting."""
+    # Means are merged from (sum, count) cells, so any selection is exact
+    everything = list(countries) == ['all']
+    select = 'by_level' if everything else 'by_country_level'
+    cells = getattr(cube, select)(countries, level_min, level_max)
+    df = (cells['duration_sum'] / cells['duration_count']).to_frame('duration_time')
+    if quantiles is not None:
+        q = getattr(quantiles, select)(countries, level_min, level_max).reindex(df.index)
+        for name in QUANTILES:
+            df[f'{name}_time'] = q[name]
+    if everything:
+        df = df.reset_index()
+    return df
+
+
+def duration_table(cube, countries, level_min, level_max, quantiles=None):
+    return format_table(duration_seconds(cube, countries, level_min, level_max, quantiles))
+
+
+def gun_table(guns, countries, level_min, level_max, option):
+    return guns.top(countries, level_min, level_max, TOP_OPTIONS[option])
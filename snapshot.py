@@ -0,0 +1,148 @@
+import argparse
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from loader import DATA_DIR, DATASETS, SNAPSHOT_EXT, read_csv, resolve_path
+
+# Column roles per dataset: 'category' for country codes, 'int' columns are
+# downcast to the narrowest integer type that holds the data, 'float' to
+# float32 and 'double' kept float64. Percentages and rates are shown and
+# served as exported, so they stay 'double'
+SCHEMAS = {
+    'retention': {'country': 'category', 'retention_days': 'int', 'total_users': 'int',
+                  'retention_count': 'int', 'retention_percent': 'double'},
+    'loserate': {'country': 'category', 'level': 'int', 'players_started': 'int',
+                 'players_completed': 'int', 'churn_rate': 'double'},
+    'lose_users': {'country': 'category', 'level': 'int', 'players_started': 'int',
+                   'players_churned': 'int'},
+    'avg_dur_lev': {'country': 'category', 'level': 'int', 'avg_duration': 'float',
+                    'duration_sum': 'double', 'duration_count': 'int'},
+    'avg_dur_sess': {'country': 'category', 'session_rank': 'int', 'avg_session_duration': 'float',
+                     'duration_sum': 'double', 'duration_count': 'int'},
+    'popul_guns': {'country': 'category', 'level': 'int', 'gun_name': 'category',
+                   'users': 'int', 'percentage': 'double'},
+    'dur_hist_lev': {'country': 'category', 'level': 'int', 'bucket': 'int', 'count': 'int'},
+    'dur_hist_sess': {'country': 'category', 'session_rank': 'int', 'bucket': 'int', 'count': 'int'},
+    'cohorts': {'country': 'category', 'cohort_date': 'category', 'day': 'int', 'users': 'int'},
+}
+
+
+def snapshot_path(name, data_dir=DATA_DIR):
+    return os.path.join(data_dir, name + SNAPSHOT_EXT)
+
+
+def compact(df, schema):
+    df = df.copy()
+    for col, kind in schema.items():
+        if col not in df.columns:
+            continue
+        if kind == 'category':
+            df[col] = df[col].fillna('').astype(str).astype('category')
+        elif kind == 'int':
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        elif kind == 'float':
+            df[col] = df[col].astype('float32')
+        elif kind == 'double':
+            # Sums that merged means are computed from keep full precision
+            df[col] = df[col].astype('float64')
+    return df
+
+
+def write_snapshot(name, df, path):
+    tmp = path + '.tmp'
+    # Uncompressed so that the file can be memory-mapped without decoding
+    feather.write_feather(compact(df, SCHEMAS[name]).reset_index(drop=True), tmp, compression='uncompressed')
+    os.replace(tmp, path)
+    return path
+
+
+def convert(name, data_dir=DATA_DIR):
+    # Validated on the way, with rejected rows reported under data_dir/quarantine
+    from ingest import QUARANTINE_DIR, write_clean
+    source = resolve_path(name, data_dir)
+    return write_clean(name, read_csv(source), snapshot_path(name, data_dir), os.path.join(data_dir, QUARANTINE_DIR),
+                       os.path.basename(source))
+
+
+def read_table(path):
+    # Numeric buffers stay backed by the shared page cache instead of being
+    # copied into each process
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def read_snapshot(path):
+    return read_table(path).to_pandas(split_blocks=True)
+
+
+def convert_all(data_dir=DATA_DIR):
+    done = []
+    for name in DATASETS:
+        try:
+            done.append(convert(name, data_dir))
+        except FileNotFoundError:
+            continue
+    return done
+
+
+def _rss_kb():
+    fields = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if value.strip().endswith('kB'):
+                    fields[key] = int(value.split()[0])
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 0
+    return fields.get('VmRSS', 0), fields.get('RssAnon', 0)
+
+
+def _measure(fmt, data_dir):
+    import time
+    before_rss, before_anon = _rss_kb()
+    start = time.perf_counter()
+    frames = []
+    for name in DATASETS:
+        if fmt == 'csv':
+            try:
+                frames.append(read_csv(resolve_path(name, data_dir)))
+            except FileNotFoundError:
+                continue
+        else:
+            path = snapshot_path(name, data_dir)
+            if os.path.exists(path):
+                frames.append(read_snapshot(path))
+    elapsed = time.perf_counter() - start
+    rss, anon = _rss_kb()
+    deep = sum(int(df.memory_usage(deep=True).sum()) for df in frames)
+    print(f'{fmt}\t{elapsed * 1000:.1f}\t{rss - before_rss}\t{anon - before_anon}\t{deep // 1024}')
+
+
+def compare(data_dir=DATA_DIR):
+    print('format\tload_ms\trss_kb\tprivate_kb\tframe_kb')
+    for fmt in ('csv', 'arrow'):
+        # A fresh interpreter per format so that allocations don't overlap
+        subprocess.run([sys.executable, __file__, '--measure', fmt, '--data-dir', data_dir], check=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert CSV exports to memory-mappable Arrow snapshots')
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--compare', action='store_true', help='print CSV vs Arrow load time and memory')
+    parser.add_argument('--measure', choices=['csv', 'arrow'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        _measure(args.measure, args.data_dir)
+    else:
+        for path in convert_all(args.data_dir):
+            print(path)
+        if args.compare:
+            compare(args.data_dir)
@@ -0,0 +1,189 @@
+import argparse
+from math import erf
+
+import numpy as np
+import pandas as pd
+
+from cohorts import COHORT_DAYS, to_dates, to_days
+from engine import write
+from quantiles import GAMMA, bucket_of, bucket_value
+from sections import COUNTRIES
+
+# Roughly the shape of the current exports at scale 1: ~230 countries with a
+# long-tailed user base, ~100 levels and up to ~2000 session ranks
+TOP_USERS = 400_000
+LEVELS = 100
+SESSION_RANKS = 2000
+GUNS = 12
+# Bogus level ids of the real exports, which ingest.py quarantines
+OUTLIER_LEVELS = (194000, 1940010000)
+# Install cohorts span two months ending on LAST_DAY
+COHORT_SPAN = 60
+LAST_DAY = '2024-03-31'
+
+
+def _country_users(rng, scale):
+    # Zipf-like: a handful of big markets (IN, US, RU, ...) and a long tail
+    rank = np.arange(1, len(COUNTRIES) + 1)
+    users = TOP_USERS * scale / rank ** 1.3 * rng.lognormal(0, 0.2, len(rank))
+    return np.maximum(users, 1).astype(np.int64)
+
+
+def _ragged(counts):
+    # (owner, 1-based position) pairs for owners with counts[i] positions each
+    owner = np.repeat(np.arange(len(counts)), counts)
+    start = np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.arange(len(owner)) - start + 1
+
+
+def _retention(rng, users):
+    rows = []
+    for days, mean in ((1, 0.2), (7, 0.05)):
+        p = np.clip(rng.normal(mean, mean / 3, len(users)), 0.005, 1)
+        count = rng.binomial(users, p)
+        rows.append(pd.DataFrame({'country': COUNTRIES, 'retention_days': days, 'total_users': users,
+                                  'retention_count': count}))
+    df = pd.concat(rows, ignore_index=True)
+    df = df.loc[df['retention_count'] > 0]
+    df['retention_percent'] = (df['retention_count'] * 100.0 / df['total_users']).round(2)
+    return df.sample(frac=1, random_state=int(rng.integers(1 << 31))).reset_index(drop=True)
+
+
+def _cohorts(rng, users):
+    # Installs spread over the span, each cohort's activity decaying as a
+    # power of the days since install; days past LAST_DAY aren't observed
+    size = rng.poisson(users[:, None] / COHORT_SPAN * rng.lognormal(0, 0.3, (len(users), COHORT_SPAN)))
+    day = np.arange(COHORT_DAYS + 1)
+    curve = np.clip(rng.normal(0.2, 0.05, len(users)), 0.02, 0.9)[:, None] * np.maximum(day, 1) ** -0.6
+    curve[:, 0] = 1
+    active = rng.binomial(size[:, :, None], curve[:, None, :])
+    c, k, d = np.nonzero(active)
+    keep = k + d < COHORT_SPAN
+    c, k, d = c[keep], k[keep], d[keep]
+    first = to_days(pd.Series([LAST_DAY])).iloc[0] - COHORT_SPAN + 1
+    return pd.DataFrame({'country': np.array(COUNTRIES)[c], 'cohort_date': to_dates(first + k), 'day': d,
+                         'users': active[c, k, d]})
+
+
+def _levels(rng, users, scale):
+    levels = LEVELS * scale
+    decay = np.log(1000) / levels
+    reach = np.minimum(levels, (np.log(users) / decay).astype(np.int64) + 1)
+    c, level = _ragged(reach)
+    started = np.maximum(1, (users[c] * np.exp(-decay * (level - 1))).astype(np.int64))
+    # Some levels are much harder than their neighbours
+    difficulty = rng.beta(2, 8, levels + 1)
+    completed = rng.binomial(started, 1 - difficulty[level])
+
+    df = pd.DataFrame({'country': np.array(COUNTRIES)[c], 'level': level,
+                       'players_started': started, 'players_completed': completed})
+    outliers = rng.choice(len(COUNTRIES), 20, replace=False)
+    df = pd.concat([df, pd.DataFrame({
+        'country': np.array(COUNTRIES)[outliers], 'level': rng.choice(OUTLIER_LEVELS, 20),
+        'players_started': 1, 'players_completed': 1})], ignore_index=True)
+    return df
+
+
+def _loserate(levels):
+    df = levels.loc[levels['players_completed'] > 0].copy()
+    df['churn_rate'] = (df['players_started'] - df['players_completed']) / df['players_started'] * 100
+    return df.reset_index(drop=True)
+
+
+def _lose_users(levels):
+    df = _loserate(levels)
+    return df.assign(players_churned=df['players_started'] - df['players_completed'])[
+        ['country', 'level', 'players_started', 'players_churned']]
+
+
+def _durations(rng, cells, level_col, avg_col, typical, count, sigma, block=20_000):
+    # Each cell's durations are lognormal around its typical value; they are
+    # drawn straight into the engine's buckets, and the sums follow from the
+    # buckets so that means and quantiles agree
+    width = np.log(GAMMA)
+    offsets = np.arange(-int(3 * sigma / width), int(3 * sigma / width) + 1)
+    cdf = np.array([0.5 * (1 + erf(x / (sigma * np.sqrt(2)))) for x in (offsets + 0.5) * width])
+    pvals = np.diff(np.r_[0.0, cdf[:-1], 1.0])
+    center = bucket_of(typical)
+    hist = []
+    for start in range(0, len(cells), block):
+        draws = rng.multinomial(count[start:start + block], pvals)
+        row, k = np.nonzero(draws)
+        hist.append(pd.DataFrame({'cell': row + start, 'bucket': np.maximum(center[row + start] + offsets[k], 1),
+                                  'count': draws[row, k]}))
+    hist = pd.concat(hist, ignore_index=True).groupby(['cell', 'bucket'], as_index=False)['count'].sum()
+    total = np.bincount(hist['cell'], weights=hist['count'] * bucket_value(hist['bucket']), minlength=len(cells))
+
+    keys = cells[['country', level_col]].reset_index(drop=True)
+    averages = keys.assign(**{avg_col: total / count}, duration_sum=total, duration_count=count)
+    hist = pd.concat([keys.iloc[hist['cell']].reset_index(drop=True), hist[['bucket', 'count']]], axis=1)
+    return averages, hist
+
+
+def _avg_dur_lev(rng, levels):
+    df = levels.loc[(levels['players_completed'] > 0) & ~levels['level'].isin(OUTLIER_LEVELS)]
+    typical = (40 + df['level'].to_numpy() * 0.8) * rng.lognormal(0, 0.3, len(df))
+    return _durations(rng, df, 'level', 'avg_duration', typical, df['players_completed'].to_numpy(), 0.4)
+
+
+def _avg_dur_sess(rng, users, scale):
+    ranks = SESSION_RANKS * scale
+    # Share of players with at least r sessions falls off as r^-1.5
+    reach = np.minimum(ranks, (users ** (2 / 3) * scale ** (1 / 3)).astype(np.int64))
+    c, rank = _ragged(np.maximum(reach, 1))
+    sessions = np.maximum(1, users[c] / rank ** 1.5).astype(np.int64)
+    cells = pd.DataFrame({'country': np.array(COUNTRIES)[c], 'session_rank': rank})
+    avg, hist = _durations(rng, cells, 'session_rank', 'avg_session_duration',
+                           rng.lognormal(5.5, 0.5, len(c)), sessions, 0.8)
+    return avg.sample(frac=1, random_state=int(rng.integers(1 << 31))).reset_index(drop=True), hist
+
+
+def _popul_guns(rng, levels, scale, block=100_000):
+    guns = np.array([f'gun_{i:03d}' for i in range(GUNS)])
+    df = levels.loc[~levels['level'].isin(OUTLIER_LEVELS)]
+    share = rng.dirichlet(np.ones(len(guns)) * 0.8, LEVELS * scale + 1)
+    parts = []
+    # In blocks, so that the rows x guns draw stays small at 100x
+    for start in range(0, len(df), block):
+        part = df.iloc[start:start + block]
+        started = part['players_started'].to_numpy()
+        users = rng.binomial(started[:, None], np.minimum(1, share[part['level'].to_numpy()] * 1.3))
+        row, gun = np.nonzero(users)
+        out = pd.DataFrame({'country': part['country'].to_numpy()[row], 'level': part['level'].to_numpy()[row],
+                            'gun_name': guns[gun], 'users': users[row, gun]})
+        out['percentage'] = out['users'] / started[row] * 100
+        parts.append(out)
+    out = pd.concat(parts, ignore_index=True)
+    return out.sort_values(['country', 'level', 'percentage'], ascending=[True, True, False]).reset_index(drop=True)
+
+
+def generate(scale=1, seed=0):
+    """The dashboard datasets, schema-compatible with the CSV exports."""
+    rng = np.random.default_rng(seed)
+    users = _country_users(rng, scale)
+    levels = _levels(rng, users, scale)
+    retention = _retention(rng, users)
+    avg_dur_lev, dur_hist_lev = _avg_dur_lev(rng, levels)
+    avg_dur_sess, dur_hist_sess = _avg_dur_sess(rng, users, scale)
+    return {
+        'retention': retention,
+        'loserate': _loserate(levels),
+        'lose_users': _lose_users(levels),
+        'avg_dur_lev': avg_dur_lev,
+        'avg_dur_sess': avg_dur_sess,
+        'popul_guns': _popul_guns(rng, levels, scale),
+        'dur_hist_lev': dur_hist_lev,
+        'dur_hist_sess': dur_hist_sess,
+        'cohorts': _cohorts(rng, users),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic dashboard datasets')
+    parser.add_argument('out')
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for path in write(generate(args.scale, args.seed), args.out, stamp='000000000000'):
+        print(path)
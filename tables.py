@@ -0,0 +1,97 @@
+import threading
+
+import numpy as np
+
+from sections import format_table
+
+PAGE_SIZE = 100
+
+
+class PagedTable:
+    """A finished table that is sorted and paged on the server.
+
+    Holds the unformatted rows (times as seconds, so they sort as numbers)
+    and only the rows of the requested page are formatted and sent to the
+    browser. The sort order of a column is built the first time a page is
+    sorted by it, and the descending order is derived from the ascending
+    one. Shared through the output cache, which sets ``on_grow`` to be told
+    the bytes of each order added after the table was stored.
+    """
+
+    def __init__(self, df, page_size=PAGE_SIZE):
+        self.df = df.reset_index(drop=not _named(df))
+        self.page_size = page_size
+        self.on_grow = None
+        self._orders = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.df)
+
+    @property
+    def columns(self):
+        return list(self.df.columns)
+
+    @property
+    def pages(self):
+        return max(1, -(-len(self.df) // self.page_size))
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            orders = sum(order.nbytes for order in self._orders.values())
+        return int(self.df.memory_usage(index=True, deep=True).sum()) + orders
+
+    def _order(self, column, ascending):
+        with self._lock:
+            order = self._orders.get((column, ascending))
+            if order is not None:
+                return order
+            added = 0
+            up = self._orders.get((column, True))
+            if up is None:
+                up = self._orders[column, True] = _ascending(self.df[column])
+                added += up.nbytes
+            order = up
+            if not ascending:
+                order = self._orders[column, False] = _descending(self.df[column], up)
+                added += order.nbytes
+        if self.on_grow is not None:
+            self.on_grow(added)
+        return order
+
+    def page(self, number, column=None, ascending=True):
+        """Formatted rows of page ``number`` (from 1), sorted by ``column``."""
+        number = min(max(1, number), self.pages)
+        start = (number - 1) * self.page_size
+        rows = np.arange(start, min(start + self.page_size, len(self.df)))
+        if column is not None:
+            rows = self._order(column, ascending)[rows]
+        return format_table(self.df.iloc[rows])
+
+
+def _ascending(values):
+    # Stable, with missing values last
+    order = values.sort_values(kind='stable', na_position='last').index.to_numpy()
+    order.setflags(write=False)
+    return order
+
+
+def _descending(values, ascending):
+    # The runs of equal values in reverse, each run keeping its own order, so
+    # ties stay stable and missing values stay last without another sort
+    n = len(values) - int(values.isna().sum())
+    v = values.to_numpy()[ascending[:n]]
+    first = np.ones(n, dtype=bool)
+    first[1:] = v[1:] != v[:-1]
+    starts = np.flatnonzero(first)
+    sizes = np.diff(np.append(starts, n))[::-1]
+    shift = starts[::-1] - np.cumsum(sizes) + sizes
+    order = np.concatenate([ascending[:n][np.repeat(shift, sizes) + np.arange(n)], ascending[n:]])
+    order.setflags(write=False)
+    return order
+
+
+def _named(df):
+    # Country and level of a by-country table live in the index
+    return any(name is not None for name in df.index.names)
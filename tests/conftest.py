@@ -0,0 +1,60 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COUNTRIES = ['US', 'RU', 'NA', 'IN', 'BR']
+GUNS = ['pistol', 'rifle', 'uzi', 'laser']
+
+
+def make_events(n_devices=60, seed=1):
+    """Raw devices and events exports: a few sessions per device over about two weeks.
+
+    Sessions land on days 0, 1, 2, 7 and 8 after a device's first one, so
+    day-1 and day-7 retention and the cohort cells are all populated; about
+    70% of started levels are completed. Rows are shuffled, as in a real
+    export. 'NA' (Namibia) checks that no path reads it as missing.
+    """
+    rng = np.random.default_rng(seed)
+    devices = pd.DataFrame({'device_id': [f'd{i}' for i in range(n_devices)],
+                            'country': rng.choice(COUNTRIES, n_devices)})
+    base = pd.Timestamp('2023-07-01')
+    rows = []
+    for i in range(n_devices):
+        first = int(rng.integers(0, 10))
+        for s in range(int(rng.integers(1, 5))):
+            day = first + int(rng.choice([0, 1, 2, 7, 8]))
+            start = base + pd.Timedelta(days=day, seconds=int(rng.integers(0, 80_000)))
+            for level in range(1, int(rng.integers(2, 6))):
+                t = start + pd.Timedelta(seconds=level * 60)
+                extra = json.dumps({'level_tnt': level, 'gun_name': str(rng.choice(GUNS))})
+                rows.append((f'd{i}', f's{i}_{s}', t.date(), t, 'level_started', level, 0, extra))
+                if rng.random() < 0.7:
+                    rows.append((f'd{i}', f's{i}_{s}', t.date(), t + pd.Timedelta(seconds=30), 'level_completed',
+                                 level, int(rng.integers(10, 100)), '{}'))
+    events = pd.DataFrame(rows, columns=['device_id', 'session', 'server_date', 'server_time', 'event', 'level',
+                                         'param1', 'extra'])
+    return events.sample(frac=1, random_state=seed).reset_index(drop=True), devices
+
+
+@pytest.fixture(scope='session')
+def raw(tmp_path_factory):
+    """Paths of the events and devices CSVs, and the events as read back."""
+    root = tmp_path_factory.mktemp('raw')
+    events, devices = make_events()
+    events_path, devices_path = str(root / 'events.csv'), str(root / 'devices.csv')
+    events.to_csv(events_path, index=False)
+    devices.to_csv(devices_path, index=False)
+    from engine import read_events
+    return events_path, devices_path, pd.concat(read_events(events_path, 1_000), ignore_index=True)
+
+
+@pytest.fixture(scope='session')
+def expected(raw):
+    from engine import run
+    return run(raw[0], raw[1], chunksize=97)
@@ -0,0 +1,72 @@
+import io
+import json
+import urllib.error
+import urllib.request
+
+import pyarrow as pa
+import pytest
+
+
+@pytest.fixture(scope='module')
+def base(expected, tmp_path_factory):
+    from engine import write
+    root = tmp_path_factory.mktemp('api')
+    write(expected, str(root / 'data'))
+    with pytest.MonkeyPatch.context() as mp:
+        # The API serves the relative 'data' directory when no snapshot is built
+        mp.chdir(root)
+        mp.setenv('DASHBOARD_REFRESH_SECONDS', '0')
+        import api
+        server = api.serve(0)
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def get(url, headers=None):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {})) as r:
+            return r.status, r.headers, r.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+@pytest.mark.parametrize('path', ['retention', 'loserate?countries=US,IN', 'churn?level_min=2&level_max=3',
+                                  'level_duration', 'session_duration?countries=US', 'guns?top=3'])
+def test_json_and_arrow_agree(base, path):
+    status, headers, body = get(f'{base}/{path}')
+    assert status == 200 and headers['Content-Type'] == 'application/json'
+    rows = json.loads(body)
+    assert rows
+    status, headers, body = get(f'{base}/{path}', {'Accept': 'application/vnd.apache.arrow.stream'})
+    assert status == 200
+    table = pa.ipc.open_stream(io.BytesIO(body)).read_all()
+    assert table.num_rows == len(rows)
+    assert table.schema.names == list(rows[0])
+
+
+def test_duration_columns(base):
+    rows = json.loads(get(f'{base}/level_duration?countries=all')[2])
+    assert list(rows[0]) == ['level', 'duration_time', 'median_time', 'p90_time']
+    rows = json.loads(get(f'{base}/level_duration?countries=US')[2])
+    assert list(rows[0])[:3] == ['country', 'level', 'duration_time']
+
+
+def test_unchanged_data_answers_304(base):
+    status, headers, _ = get(f'{base}/guns?countries=US')
+    tag = headers['ETag']
+    status, headers, body = get(f'{base}/guns?countries=US', {'If-None-Match': tag})
+    assert status == 304 and headers['ETag'] == tag and body == b''
+    # Another selection or format is another tag
+    assert get(f'{base}/guns?countries=IN')[1]['ETag'] != tag
+    assert get(f'{base}/guns?countries=US&format=arrow')[1]['ETag'] != tag
+    # The same selection spelled differently is not
+    assert get(f'{base}/guns?countries=US,US')[1]['ETag'] == tag
+
+
+@pytest.mark.parametrize('path, status', [
+    ('nope', 404), ('guns?top=7', 400), ('loserate?level_min=x', 400), ('retention?day=abc', 400),
+    ('retention?day=99', 400), ('guns?format=xml', 400),
+])
+def test_bad_requests(base, path, status):
+    code, headers, body = get(f'{base}/{path}')
+    assert code == status
+    assert 'error' in json.loads(body)
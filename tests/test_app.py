@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app.py')
+PAGES = ['loserate', 'churn', 'level_duration', 'session_duration', 'guns']
+
+
+@pytest.fixture(scope='module')
+def data_root(expected, tmp_path_factory):
+    from engine import write
+    root = tmp_path_factory.mktemp('app')
+    write(expected, str(root / 'data'))
+    return root
+
+
+@pytest.fixture
+def app(data_root, monkeypatch):
+    from streamlit.testing.v1 import AppTest
+    # app.py reads the relative 'data' directory and shouldn't start the refresh worker
+    monkeypatch.chdir(data_root)
+    monkeypatch.setenv('DASHBOARD_REFRESH_SECONDS', '0')
+    at = AppTest.from_file(APP, default_timeout=60)
+    at.run()
+    assert not at.exception
+    return at
+
+
+def _open(at, name):
+    # st.navigation pages are functions, which AppTest.switch_page can't address
+    at._page_hash = {info['url_pathname']: h for h, info in at._registered_pages.items()}[name]
+    return at.run()
+
+
+@pytest.mark.parametrize('page', PAGES)
+def test_page_renders(app, page):
+    _open(app, page)
+    assert not app.exception
+    assert app.multiselect[0].value
+
+
+@pytest.mark.parametrize('page', PAGES)
+def test_empty_country_selection(app, page):
+    _open(app, page)
+    app.multiselect[0].set_value([]).run()
+    assert not app.exception
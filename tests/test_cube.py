@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cube import LevelCube
+
+VALUES = ['players_started', 'players_completed']
+
+
+@pytest.fixture
+def cube():
+    # Levels 1..10 for US and 1..5 for IN, plus an outlier level id 1000
+    rng = np.random.default_rng(0)
+    levels = list(range(1, 11)) + list(range(1, 6)) + [1000]
+    started = rng.integers(50, 100, len(levels))
+    return LevelCube(pd.DataFrame({
+        'country': ['US'] * 10 + ['IN'] * 5 + ['US'],
+        'level': levels,
+        'players_started': started,
+        'players_completed': started - rng.integers(0, 50, len(levels)),
+    }), VALUES)
+
+
+def test_binned_passes_small_ranges_through(cube):
+    df = cube.binned(['all'], 1, 10, 10)
+    assert df.index.tolist() == list(range(1, 11))
+    assert (df['last_level'] == df.index).all()
+    pd.testing.assert_frame_equal(df[VALUES], cube.by_level(['all'], 1, 10))
+
+
+@pytest.mark.parametrize('countries', [['all'], ['US'], ['IN']])
+@pytest.mark.parametrize('max_bins', [1, 3, 4])
+def test_binned_keeps_the_totals(cube, countries, max_bins):
+    levels = cube.by_level(countries, 1, 1000)
+    df = cube.binned(countries, 1, 1000, max_bins)
+    assert len(df) == min(max_bins, len(levels))
+    assert df[VALUES].sum().tolist() == levels.sum().tolist()
+
+
+def test_binned_runs_cover_the_levels_by_rank(cube):
+    df = cube.binned(['US'], 1, 1000, 4)
+    levels = cube.by_level(['US'], 1, 1000).index.tolist()
+    # Each run starts right after the previous one ends; the outlier only
+    # joins the last run instead of stretching it over the ids in between
+    firsts, lasts = df.index.tolist(), df['last_level'].tolist()
+    assert firsts[0] == levels[0] and lasts[-1] == 1000
+    assert [levels.index(f) for f in firsts[1:]] == [levels.index(x) + 1 for x in lasts[:-1]]
+    assert firsts[-1] < 1000
+
+
+def test_binned_empty_selection(cube):
+    assert cube.binned([], 1, 1000, 3).empty
+    assert cube.binned(['all'], 20, 30, 3).empty
@@ -0,0 +1,40 @@
+import pandas as pd
+import pytest
+
+from guns import GunPopularity
+
+
+@pytest.fixture
+def guns():
+    # US: 100 players on level 1, 80 of them with the uzi and 30 with the
+    # pistol; IN: 10 players, 10 with the pistol. Level 2: one gun, US only
+    return GunPopularity(pd.DataFrame({
+        'country': ['US', 'US', 'IN', 'US'],
+        'level': [1, 1, 1, 2],
+        'gun_name': ['uzi', 'pistol', 'pistol', 'uzi'],
+        'users': [80, 30, 10, 5],
+        'percentage': [80.0, 30.0, 100.0, 50.0],
+    }))
+
+
+def test_shares_are_weighted_by_players(guns):
+    top = guns.top(['all'], 1, 1, 2)
+    # pistol: (30 + 10) / (100 + 10), not the mean of 30% and 100%
+    assert top['gun_name'].tolist() == ['uzi', 'pistol']
+    assert top['popularity'].tolist() == pytest.approx([80 / 110 * 100, 40 / 110 * 100])
+
+
+def test_country_selection(guns):
+    top = guns.top(['IN'], 1, 2, 3)
+    # IN has no level 2 players and never used the uzi, so neither appears
+    assert top.to_dict('records') == [{'level': 1, 'gun_name': 'pistol', 'popularity': 100.0}]
+
+
+def test_top_n_per_level(guns):
+    top = guns.top(['US'], 1, 2, 1)
+    assert top[['level', 'gun_name']].values.tolist() == [[1, 'uzi'], [2, 'uzi']]
+    assert top['popularity'].tolist() == pytest.approx([80.0, 50.0])
+
+
+def test_level_range_outside_the_data(guns):
+    assert guns.top(['all'], 5, 9, 3).empty
@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+
+from ingest import MAX_LEVEL, validate
+
+
+def _lose_users(rows):
+    return pd.DataFrame(rows, columns=['country', 'level', 'players_started', 'players_churned'])
+
+
+def test_rows_are_quarantined_with_their_reason():
+    df = _lose_users([
+        ['US', '1', '100', '10'],
+        ['US', '2', 'abc', '10'],        # not a number
+        ['US', '3', '100.5', '10'],      # not a whole number
+        ['', '4', '100', '10'],          # no country
+        ['US', None, '100', '10'],       # no level
+        ['US', str(MAX_LEVEL + 1), '100', '10'],
+        ['US', '6', '-1', '10'],         # a negative count
+        ['US', '1', '50', '5'],          # the key of the first row again
+        ['IN', '1', '7', '0'],
+    ])
+    clean, quarantined = validate('lose_users', df)
+    assert quarantined['reason'].tolist() == ['type', 'type', 'missing', 'missing', 'range', 'range', 'duplicate']
+    # Quarantined rows keep their raw values
+    assert quarantined['players_started'].tolist()[:2] == ['abc', '100.5']
+    assert clean[['country', 'level', 'players_started']].astype(object).values.tolist() == [
+        ['US', 1, 100], ['IN', 1, 7]]
+
+
+def test_first_failed_check_names_the_reason():
+    # Both a bad type and out of range: type comes first in REASONS
+    df = _lose_users([['US', '0', 'x', '1']])
+    assert validate('lose_users', df)[1]['reason'].tolist() == ['type']
+
+
+def test_a_failed_row_does_not_make_its_twin_a_duplicate():
+    df = _lose_users([['US', '1', 'x', '1'], ['US', '1', '5', '1']])
+    clean, quarantined = validate('lose_users', df)
+    assert quarantined['reason'].tolist() == ['type']
+    assert len(clean) == 1
+
+
+def test_a_missing_key_column_rejects_the_export():
+    with pytest.raises(ValueError, match='level'):
+        validate('lose_users', pd.DataFrame({'country': ['US'], 'players_started': [1]}))
@@ -0,0 +1,43 @@
+import numpy as np
+
+from memo import OutputCache, filter_state
+
+
+class Sized:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+
+def test_least_recently_used_entries_are_evicted_past_max_bytes():
+    cache = OutputCache(max_bytes=100)
+    computed = []
+
+    def compute(key, size):
+        def fn():
+            computed.append(key)
+            return Sized(size)
+        return fn
+
+    a = cache.get('a', compute('a', 40))
+    cache.get('b', compute('b', 40))
+    assert cache.get('a', compute('a', 40)) is a
+    # 'b' is now the least recently used and makes room for 'c'
+    cache.get('c', compute('c', 40))
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == 80
+    cache.get('a', compute('a', 40))
+    cache.get('b', compute('b', 40))
+    assert computed == ['a', 'b', 'c', 'b']
+
+
+def test_outputs_larger_than_the_cache_are_not_kept():
+    cache = OutputCache(max_bytes=100)
+    cache.get('small', lambda: Sized(10))
+    cache.get('huge', lambda: Sized(500))
+    assert cache.stats()['entries'] == 1
+    assert cache.stats()['bytes'] == 10
+
+
+def test_equivalent_selections_share_a_key():
+    assert filter_state(['US', 'IN', 'US'], (np.int64(1), 10)) == filter_state(['IN', 'US'], (1, 10))
+    assert filter_state(['all', 'US']) == filter_state(['all'])
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sketch import (PRECISION, SketchBuilder, SketchStore, estimate, hash_ids, merge_stores, register_updates,
+                    scatter_max)
+
+
+def registers(ids, p=PRECISION):
+    out = np.zeros(1 << p, dtype=np.uint8)
+    idx, rank = register_updates(hash_ids(ids), p)
+    scatter_max(out, 0, idx, rank)
+    return out
+
+
+def build(cells):
+    """A store from {(country, level): device ids}, one add per cell."""
+    builder = SketchBuilder()
+    for (country, level), ids in cells.items():
+        keys = pd.DataFrame({'metric': 'level_started', 'country': country, 'level': level, 'day': 0},
+                            index=range(len(ids)))
+        builder.add(keys, hash_ids(ids))
+    return builder.store()
+
+
+@pytest.mark.parametrize('n', [0, 1, 100, 10_000, 300_000])
+def test_estimate_error(n):
+    ids = np.arange(n) * 7919
+    # Three standard errors of 1.04 / sqrt(m)
+    assert estimate(registers(ids))[0] == pytest.approx(n, rel=3 * 1.04 / np.sqrt(1 << PRECISION), abs=0.5)
+
+
+def test_union_of_cells_is_the_sketch_of_the_union():
+    rng = np.random.default_rng(0)
+    # A small sparse cell, and a big one that takes a dense row
+    cells = {('US', 1): rng.integers(0, 50, 40), ('US', 2): rng.integers(0, 20_000, 30_000),
+             ('IN', 1): rng.integers(10, 60, 40)}
+    store = build(cells)
+    assert (store.dense_pos >= 0).sum() == 1
+
+    both = np.concatenate(list(cells.values()))
+    assert store.count('level_started') == estimate(registers(both))[0]
+    us = np.concatenate([cells['US', 1], cells['US', 2]])
+    assert store.count('level_started', countries=['US']) == estimate(registers(us))[0]
+    by_level = store.count_by('level_started', 'level')
+    level_1 = np.concatenate([cells['US', 1], cells['IN', 1]])
+    assert by_level.loc[1] == estimate(registers(level_1))[0]
+    assert store.count('level_started', level_min=3) == 0.0
+
+
+def test_merge_matches_one_store(tmp_path):
+    rng = np.random.default_rng(1)
+    cells = {('US', level): rng.integers(0, 5_000, 3_000) for level in range(1, 4)}
+    whole = build(cells)
+    # The same cells split across two partitions, with overlapping devices
+    halves = [build({k: v[i::2] for k, v in cells.items()}) for i in range(2)]
+    merged = merge_stores(halves)
+    assert merged.count('level_started') == whole.count('level_started')
+    pd.testing.assert_series_equal(merged.count_by('level_started', 'level'),
+                                   whole.count_by('level_started', 'level'))
+
+    path = str(tmp_path / 'sketches.npz')
+    merged.save(path)
+    loaded = SketchStore.load(path)
+    assert loaded.count('level_started', level_max=2) == merged.count('level_started', level_max=2)
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from memo import OutputCache
+from sections import convert_time, format_durations
+from tables import PagedTable
+
+
+def test_format_durations_matches_convert_time():
+    seconds = np.array([0, 0.9, 59, 61.5, 3599, 3600, 86_399, 359_999, 360_000, -5])
+    assert format_durations(seconds).tolist() == [convert_time(s) for s in seconds]
+
+
+def test_format_durations_keeps_missing_values():
+    out = format_durations(np.array([np.nan, 75.0]))
+    assert pd.isna(out[0]) and out[1] == '00:01:15'
+
+
+@pytest.fixture
+def table():
+    return PagedTable(pd.DataFrame({
+        'level': np.arange(1, 251),
+        'duration_time': np.r_[np.nan, np.arange(249) % 7 * 60.0],
+    }), page_size=100)
+
+
+def test_pages(table):
+    assert table.pages == 3
+    assert table.page(1)['level'].tolist() == list(range(1, 101))
+    assert table.page(3)['level'].tolist() == list(range(201, 251))
+    # Out-of-range page numbers are clamped
+    assert table.page(9)['level'].tolist() == list(range(201, 251))
+    assert table.page(0)['level'].tolist() == list(range(1, 101))
+
+
+@pytest.mark.parametrize('ascending', [True, False])
+def test_sorted_pages_match_a_stable_sort(table, ascending):
+    expected = table.df.sort_values('duration_time', ascending=ascending, kind='stable', na_position='last')
+    rows = pd.concat([table.page(n, 'duration_time', ascending) for n in range(1, table.pages + 1)])
+    assert rows['level'].tolist() == expected['level'].tolist()
+    # Only the page's rows are formatted
+    assert rows['duration_time'].iloc[0] == ('00:00:00' if ascending else '00:06:00')
+    assert pd.isna(rows['duration_time'].iloc[-1])
+
+
+def test_orders_are_counted_by_the_output_cache(table):
+    cache = OutputCache()
+    stored = table.nbytes
+    cache.get('table', lambda: table)
+    assert cache.stats()['bytes'] == stored
+    table.page(1, 'level', ascending=False)
+    assert cache.stats()['bytes'] == table.nbytes > stored
+    grown = table.nbytes
+    # An order already built adds nothing
+    table.page(2, 'level', ascending=True)
+    assert cache.stats()['bytes'] == grown
+
+
+def test_growing_past_max_bytes_evicts(table):
+    cache = OutputCache(max_bytes=table.nbytes + 100)
+    cache.get('table', lambda: table)
+    table.page(1, 'duration_time')
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['bytes'] == 0